@@ -0,0 +1,172 @@
+import importlib
+import time
+import numpy as np
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+
+class TfliteBackend:
+    """
+    TFLite interpreter, either from tflite_runtime or from full TensorFlow.
+
+    XNNPACK delegate is applied by default by the interpreter,
+    disabling it means using the builtin op resolver without default delegates.
+    """
+    def __init__(self, interpreter_class, op_resolver_type, model_file: str, num_threads: int, xnnpack: bool):
+        kwargs = {'model_path': model_file, 'num_threads': num_threads or None}
+        if not xnnpack:
+            kwargs['experimental_op_resolver_type'] = op_resolver_type.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        self.interpreter = interpreter_class(**kwargs)
+        self.interpreter.allocate_tensors()
+
+        # Get index of input tensor
+        input_details = self.interpreter.get_input_details()
+        self.input_tensor = input_details[0]['index']
+        _, self.input_h, self.input_w, _ = input_details[0]['shape']
+        self.input_dtype = input_details[0]['dtype']
+
+        # Get indexes of resulting tensors
+        output_details = self.interpreter.get_output_details()
+        self.boxes_tensor = output_details[0]['index']
+        self.classes_tensor = output_details[1]['index']
+        self.scores_tensor = output_details[2]['index']
+        self.num_det_tensor = output_details[3]['index']
+
+    def set_input(self, fill):
+        # Write directly into the input tensor memory. The view must be released before
+        # invoke(), the interpreter refuses to run while its internal buffers are referenced.
+        input_view = self.interpreter.tensor(self.input_tensor)()
+        fill(input_view[0])
+        del input_view
+
+    def invoke(self):
+        self.interpreter.invoke()
+
+    def outputs(self):
+        num_det = int(self.interpreter.get_tensor(self.num_det_tensor)[0])
+        boxes = self.interpreter.get_tensor(self.boxes_tensor)[0][:num_det]
+        classes = self.interpreter.get_tensor(self.classes_tensor)[0][:num_det]
+        scores = self.interpreter.get_tensor(self.scores_tensor)[0][:num_det]
+        return boxes, classes, scores
+
+
+class OnnxBackend:
+    """
+    ONNX Runtime with an SSD model exported from TF Object Detection API,
+    e.g. ssd_mobilenet_v1 from the ONNX model zoo. Class ids there start from 1.
+    """
+    def __init__(self, ort, model_file: str, num_threads: int, xnnpack: bool):
+        options = ort.SessionOptions()
+        providers = ['CPUExecutionProvider']
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        if xnnpack and 'XnnpackExecutionProvider' in ort.get_available_providers():
+            providers.insert(0, ('XnnpackExecutionProvider', {'intra_op_num_threads': num_threads or 1}))
+        self.session = ort.InferenceSession(model_file, options, providers=providers)
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # Input size is usually dynamic in exported models, use the native SSD one then
+        _, h, w, _ = model_input.shape
+        self.input_h = h if isinstance(h, int) else 300
+        self.input_w = w if isinstance(w, int) else 300
+        self.input_dtype = np.uint8
+        self.input = np.zeros((1, self.input_h, self.input_w, 3), dtype=np.uint8)
+
+        names = [o.name for o in self.session.get_outputs()]
+        def find(key):
+            return next(name for name in names if key in name)
+        self.output_names = [find('boxes'), find('classes'), find('scores'), find('num')]
+        self.results = None
+
+    def set_input(self, fill):
+        fill(self.input[0])
+
+    def invoke(self):
+        self.results = self.session.run(self.output_names, {self.input_name: self.input})
+
+    def outputs(self):
+        boxes, classes, scores, num_det = self.results
+        num_det = int(num_det[0])
+        return boxes[0][:num_det], classes[0][:num_det] - 1, scores[0][:num_det]
+
+
+class OpenCvBackend:
+    """
+    OpenCV DNN with a frozen TF Object Detection API graph and its text config
+    (`model.pb` and `model.pbtxt` next to it), class ids there start from 1.
+    """
+    def __init__(self, cv2, model_file: str, num_threads: int, xnnpack: bool):
+        if num_threads:
+            cv2.setNumThreads(num_threads)
+        self.cv2 = cv2
+        config_file = model_file.rsplit('.', 1)[0] + '.pbtxt'
+        self.net = cv2.dnn.readNetFromTensorflow(model_file, config_file)
+        self.input_h = self.input_w = 300
+        self.input_dtype = np.uint8
+        self.input = np.zeros((self.input_h, self.input_w, 3), dtype=np.uint8)
+        self.results = None
+
+    def set_input(self, fill):
+        fill(self.input)
+
+    def invoke(self):
+        # The graph does its own normalization, it takes RGB values as is
+        self.net.setInput(self.cv2.dnn.blobFromImage(self.input))
+        self.results = self.net.forward()
+
+    def outputs(self):
+        # [1, 1, N, 7] of image_id, class_id, score, xmin, ymin, xmax, ymax
+        det = self.results[0, 0]
+        boxes = det[:, [4, 3, 6, 5]]
+        return boxes, det[:, 1] - 1, det[:, 2]
+
+
+def _create_tflite(module, model_file: str, num_threads: int, xnnpack: bool):
+    return TfliteBackend(module.Interpreter, module.OpResolverType, model_file, num_threads, xnnpack)
+
+
+def _create_tf(module, model_file: str, num_threads: int, xnnpack: bool):
+    return TfliteBackend(module.lite.Interpreter, module.lite.experimental.OpResolverType, model_file, num_threads, xnnpack)
+
+
+# Backend name -> (module to import, factory, default model)
+BACKENDS = {
+    'tflite': ('tflite_runtime.interpreter', _create_tflite, '../models/ssd_mobilenet_v1/mobilenet.tflite'),
+    'tf': ('tensorflow', _create_tf, '../models/ssd_mobilenet_v1/mobilenet.tflite'),
+    'onnx': ('onnxruntime', OnnxBackend, '../models/ssd_mobilenet_v1/ssd_mobilenet_v1.onnx'),
+    'opencv': ('cv2', OpenCvBackend, '../models/ssd_mobilenet_v1/ssd_mobilenet_v1.pb'),
+}
+
+
+def _peak_rss_mb():
+    if not resource:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def create_backend(name: str, model_file: str = None, num_threads: int = 0, xnnpack: bool = True):
+    """
+    Imports the backend library only when the backend is requested,
+    so e.g. TensorFlow is never loaded when running on tflite_runtime.
+    """
+    if name not in BACKENDS:
+        raise Exception(f'Unsupported backend {name}, available: {", ".join(BACKENDS)}')
+    module_name, factory, default_model = BACKENDS[name]
+
+    start_time = time.perf_counter()
+    module = importlib.import_module(module_name)
+    import_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    backend = factory(module, model_file or default_model, num_threads, xnnpack)
+    load_time = time.perf_counter() - start_time
+
+    peak_rss = _peak_rss_mb()
+    peak_rss = f'{peak_rss:.0f} MB' if peak_rss is not None else 'n/a'
+    print(f'Backend {name}: import {import_time:.3f} s, load {load_time:.3f} s, peak RSS {peak_rss}')
+    return backend
@@ -0,0 +1,143 @@
+import collections
+import concurrent.futures
+import glob
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import cv2
+
+import metrics
+from detector import Preprocessor
+
+
+_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def list_images(source: str):
+    """
+    Lazily lists images of a directory, a glob pattern, or a list file given as @file.txt with a path per line.
+    """
+    if source.startswith('@'):
+        with open(source[1:]) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+    elif os.path.isdir(source):
+        for entry in os.scandir(source):
+            if entry.is_file() and entry.name.lower().endswith(_IMAGE_EXTENSIONS):
+                yield entry.path
+    else:
+        yield from glob.iglob(source, recursive=True)
+
+
+def is_batch_source(source: str) -> bool:
+    return source.startswith('@') or os.path.isdir(source) or any(c in source for c in '*?[')
+
+
+class BatchDetector:
+    """
+    Detects objects in many image files with bounded memory.
+
+    Images are decoded and preprocessed by a pool of threads (OpenCV releases the GIL),
+    inference runs on a small pool of detectors reused for all images, one per thread.
+    At most `prefetch` images are in flight, results are written in input order
+    as JSON lines as soon as they are ready.
+    """
+    def __init__(self, make_detector, decode_workers: int, pool_size: int, prefetch: int = 0, renderer=None, annotate_dir: str = None):
+        self.make_detector = make_detector
+        self.decode_workers = decode_workers
+        self.pool_size = pool_size
+        self.prefetch = prefetch or 4 * (decode_workers + pool_size)
+        self.renderer = renderer
+        self.annotate_dir = annotate_dir
+
+        # Detectors are created upfront, the decoding threads need to know their input size
+        self.detectors = queue.Queue()
+        for _ in range(pool_size):
+            detector = make_detector()
+            self.detectors.put(detector)
+        self.labels = detector.labels
+        self.input_size = (detector.backend.input_w, detector.backend.input_h)
+        self.letterbox = detector.preprocess.letterbox
+        self.input_dtype = detector.preprocess.dtype
+        self.local = threading.local()
+
+    @metrics.timed('decode')
+    def _decode(self, file_name: str):
+        if not hasattr(self.local, 'preprocess'):
+            self.local.preprocess = Preprocessor(*self.input_size, self.letterbox, self.input_dtype)
+        img = cv2.imread(file_name)
+        if img is None:
+            raise Exception('Failed to read image')
+        prepared = self.local.preprocess.prepare(img)
+        # Keep the full image only if it's going to be annotated
+        return (img if self.annotate_dir else None), img.shape, prepared
+
+    def _detect(self, file_name: str, decoded):
+        img, shape, prepared = decoded.result()
+        detector = self.detectors.get()
+        try:
+            det = detector.detect_prepared(prepared)
+        finally:
+            self.detectors.put(detector)
+
+        if self.annotate_dir:
+            self.renderer.draw(img, det)
+            cv2.imwrite(os.path.join(self.annotate_dir, os.path.basename(file_name)), img)
+
+        return {
+            'file': file_name,
+            'width': shape[1],
+            'height': shape[0],
+            'detections': det.to_records(self.labels),
+        }
+
+    def _result(self, file_name: str, future):
+        try:
+            return future.result()
+        except Exception as e:
+            return {'file': file_name, 'error': str(e)}
+
+    def run(self, source: str, output: str):
+        if self.annotate_dir:
+            os.makedirs(self.annotate_dir, exist_ok=True)
+
+        count = 0
+        errors = 0
+        start_time = time.perf_counter()
+        pending = collections.deque()
+        out = sys.__stdout__ if output == '-' else open(output, 'w')
+        decoders = concurrent.futures.ThreadPoolExecutor(self.decode_workers, thread_name_prefix='decode')
+        inference = concurrent.futures.ThreadPoolExecutor(self.pool_size, thread_name_prefix='detect')
+
+        def write_oldest():
+            nonlocal count, errors
+            file_name, future = pending.popleft()
+            record = self._result(file_name, future)
+            out.write(json.dumps(record) + '\n')
+            count += 1
+            errors += 'error' in record
+
+        try:
+            for file_name in list_images(source):
+                decoded = decoders.submit(self._decode, file_name)
+                pending.append((file_name, inference.submit(self._detect, file_name, decoded)))
+                if len(pending) >= self.prefetch:
+                    write_oldest()
+            while pending:
+                write_oldest()
+        finally:
+            for _, future in pending:
+                future.cancel()
+            decoders.shutdown()
+            inference.shutdown()
+            if out is not sys.__stdout__:
+                out.close()
+
+        elapsed = time.perf_counter() - start_time
+        rate = count / elapsed if elapsed else 0.0
+        print(f'Processed {count} images ({errors} errors) in {elapsed:.1f} s, {rate:.1f} images/s', file=sys.stderr)
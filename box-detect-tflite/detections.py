@@ -0,0 +1,45 @@
+import numpy as np
+
+
+class Detections:
+    """
+    Detection results as parallel arrays, one row per detected object:
+    `boxes` - int32 [N, 4] of x1, y1, x2, y2 in pixels of the source frame,
+    `classes` - int32 [N] class ids, `scores` - float32 [N] confidences.
+    """
+    def __init__(self, boxes, classes, scores):
+        self.boxes = boxes
+        self.classes = classes
+        self.scores = scores
+
+    def __len__(self):
+        return len(self.scores)
+
+    def to_records(self, labels) -> list:
+        """
+        Detections as JSON serializable dicts {class, class_id, score, box}.
+        """
+        return [
+            {'class': labels[c], 'class_id': c, 'score': round(s, 4), 'box': b}
+            for b, c, s in zip(self.boxes.tolist(), self.classes.tolist(), self.scores.tolist())
+        ]
+
+    @staticmethod
+    def empty():
+        return Detections(np.zeros((0, 4), dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32))
+
+
+def iou_matrix(a, b):
+    """
+    Intersection over union of every box in `a` [N, 4] with every box in `b` [M, 4], returns [N, M].
+    """
+    a = a.astype(np.float32)
+    b = b.astype(np.float32)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
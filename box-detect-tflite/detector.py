@@ -0,0 +1,148 @@
+import cv2
+import numpy as np
+
+import backends
+import metrics
+import models
+from detections import Detections
+
+
+_LABELS_FILE = '../models/ssd_mobilenet_v1/labelmap.txt'
+
+
+def load_labels():
+    # The first line is the background category, it is not counted in class ids
+    with open(_LABELS_FILE) as f:
+        return [name.strip() for name in f][1:]
+
+
+class PreparedInput:
+    """
+    Model input prepared in advance, e.g. in a decoding thread, with its box mapping.
+    """
+    def __init__(self, image, box_scale, box_offset):
+        self.image = image
+        self.box_scale = box_scale
+        self.box_offset = box_offset
+
+    def to_frame(self, boxes):
+        return boxes * self.box_scale + self.box_offset
+
+
+class Preprocessor:
+    """
+    Converts BGR frames of any size into the RGB model input.
+
+    The frame is resized first, so colour conversion runs on the small image,
+    and the result is written into the given destination (e.g. a view of the interpreter input tensor).
+    Intermediate buffers are reused between frames. With `letterbox` the aspect ratio
+    is kept and the rest of the input is filled with black.
+    Float models get pixel values normalized to [-1, 1].
+    """
+    def __init__(self, input_w: int, input_h: int, letterbox: bool = False, dtype=np.uint8):
+        self.input_w = input_w
+        self.input_h = input_h
+        self.letterbox = letterbox
+        self.dtype = np.dtype(dtype)
+        self.resized = np.zeros((input_h, input_w, 3), dtype=np.uint8)
+        self.rgb = np.empty((input_h, input_w, 3), dtype=np.uint8) if self.dtype != np.uint8 else None
+        self.frame_size = None
+        self.roi = None
+        self.box_scale = None
+        self.box_offset = None
+
+    def _layout(self, frame_w: int, frame_h: int):
+        if self.frame_size == (frame_w, frame_h):
+            return
+        self.frame_size = (frame_w, frame_h)
+
+        if not self.letterbox:
+            self.roi = self.resized
+            self.box_scale = np.array([frame_w, frame_h, frame_w, frame_h], dtype=np.float32)
+            self.box_offset = np.zeros(4, dtype=np.float32)
+            return
+
+        scale = min(self.input_w / frame_w, self.input_h / frame_h)
+        w, h = round(frame_w * scale), round(frame_h * scale)
+        x, y = (self.input_w - w) // 2, (self.input_h - h) // 2
+        self.resized[:] = 0
+        self.roi = self.resized[y:y+h, x:x+w]
+        self.box_scale = np.array([self.input_w, self.input_h, self.input_w, self.input_h], dtype=np.float32) / scale
+        self.box_offset = np.array([-x, -y, -x, -y], dtype=np.float32) / scale
+
+    def __call__(self, frame, dst):
+        h, w = frame.shape[:2]
+        self._layout(w, h)
+        roi_h, roi_w = self.roi.shape[:2]
+        cv2.resize(frame, (roi_w, roi_h), dst=self.roi, interpolation=cv2.INTER_AREA)
+        if self.rgb is None:
+            cv2.cvtColor(self.resized, cv2.COLOR_BGR2RGB, dst=dst)
+            return
+        cv2.cvtColor(self.resized, cv2.COLOR_BGR2RGB, dst=self.rgb)
+        np.multiply(self.rgb, 1 / 127.5, out=dst, casting='unsafe')
+        dst -= 1
+
+    def to_frame(self, boxes):
+        """
+        Converts [N, 4] boxes of x1, y1, x2, y2 relative to the model input into pixels of the last frame.
+        """
+        return boxes * self.box_scale + self.box_offset
+
+    def prepare(self, frame) -> PreparedInput:
+        image = np.empty((self.input_h, self.input_w, 3), dtype=self.dtype)
+        self(frame, image)
+        return PreparedInput(image, self.box_scale, self.box_offset)
+
+
+class ObjectDetector:
+    """
+    When model, threads or XNNPACK are not given, they are taken from the configuration saved by `tune.py`
+    if it was tuned for the same backend.
+    """
+    def __init__(self, score_threshold: float = 0.5, classes: list = None, letterbox: bool = False,
+                 backend: str = 'tflite', model_file: str = None, num_threads: int = 0, xnnpack: bool = None):
+        tuned = models.load_tuned()
+        if tuned and tuned['backend'] == backend:
+            model_file = model_file or tuned['model']
+            num_threads = num_threads or tuned['threads']
+            xnnpack = tuned['xnnpack'] if xnnpack is None else xnnpack
+        self.backend = backends.create_backend(backend, model_file, num_threads, xnnpack is not False)
+        self.preprocess = Preprocessor(self.backend.input_w, self.backend.input_h, letterbox, self.backend.input_dtype)
+
+        self.labels = load_labels()
+        self.score_threshold = score_threshold
+
+        # Allowed class ids or None to keep all classes
+        self.allowed_classes = None
+        if classes:
+            unknown = [name for name in classes if name not in self.labels]
+            if unknown:
+                raise Exception(f'Unknown classes: {", ".join(unknown)}')
+            self.allowed_classes = np.array([i for i, name in enumerate(self.labels) if name in classes], dtype=np.int32)
+
+    def detect(self, img_orig) -> Detections:
+        with metrics.timer('preprocess'):
+            self.backend.set_input(lambda dst: self.preprocess(img_orig, dst))
+        return self._run(self.preprocess)
+
+    def detect_prepared(self, prepared: PreparedInput) -> Detections:
+        self.backend.set_input(lambda dst: np.copyto(dst, prepared.image))
+        return self._run(prepared)
+
+    def _run(self, mapping) -> Detections:
+        with metrics.timer('invoke'):
+            self.backend.invoke()
+        with metrics.timer('postprocess'):
+            return self._postprocess(mapping)
+
+    def _postprocess(self, mapping) -> Detections:
+        boxes, classes, scores = self.backend.outputs()
+        classes = classes.astype(np.int32)
+
+        keep = scores >= self.score_threshold
+        if self.allowed_classes is not None:
+            keep &= np.isin(classes, self.allowed_classes)
+
+        # Boxes are [ymin, xmin, ymax, xmax] relative to the model input
+        boxes = mapping.to_frame(boxes[keep][:, [1, 0, 3, 2]])
+        return Detections(boxes.astype(np.int32), classes[keep], scores[keep])
@@ -1,93 +1,31 @@
 import argparse
+import functools
+import json
+import os
 import subprocess
+import sys
+import threading
+import time
 import cv2
-import tflite_runtime.interpreter as tflite
-
-
-_CLASS_COLORS = [
-    (0, 255, 0), (199, 21, 133), (0, 100, 0), (255, 0, 0 ),
-    (154, 205, 50), (123, 104, 238), (255, 160, 122),
-    (32, 178, 170), (216, 191, 216), (255, 255, 0),
-    (210, 105, 30), (175, 238, 238), (135, 206, 250),
-    (220, 220, 220), (255, 248, 220), (100, 149, 237),
-]
-_FONT_FACE = cv2.FONT_HERSHEY_SIMPLEX
-_FONT_SCALE = 0.75
-_FONT_WEIGHT = 1
-
-_MODEL_FILE = '../models/ssd_mobilenet_v1/mobilenet.tflite'
-_LABELS_FILE = '../models/ssd_mobilenet_v1/labelmap.txt'
-
-
-class ObjectDetector:
-    def __init__(self):
-        self.tflite = tflite.Interpreter(model_path=_MODEL_FILE)
-        self.tflite.allocate_tensors()
-
-        # Get index of input tensor
-        input_details = self.tflite.get_input_details()
-        self.input_tensor = input_details[0]['index']
-
-        # Get indexes of resulting tensors
-        output_details = self.tflite.get_output_details()
-        self.boxes_tensor = output_details[0]['index']
-        self.classes_tensor = output_details[1]['index']
-        self.scores_tensor = output_details[2]['index']
-        self.num_det_tensor = output_details[3]['index']
-
-        # Load labels
-        self.labelmap = {}
-        with open(_LABELS_FILE) as f:
-            for i, name in enumerate(f):
-                if i == 0: # background category
-                    continue
-
-                classe = i-1
-                name = name.strip()
-                text_size, baseline = cv2.getTextSize(name, _FONT_FACE, _FONT_SCALE, _FONT_WEIGHT)
-                self.labelmap[classe] = {
-                    'name': name,
-                    'txt_w': text_size[0],
-                    'txt_h': text_size[1],
-                    'baseline': baseline,
-                    'color': _CLASS_COLORS[classe % len(_CLASS_COLORS)]
-                }
-
-    def detect(self, img_orig):
-        img = cv2.cvtColor(img_orig, cv2.COLOR_BGR2RGB)
-        img = cv2.resize(img, (300, 300), cv2.INTER_AREA)
-        img = img.reshape([1, 300, 300, 3])
-
-        self.tflite.set_tensor(self.input_tensor, img)
-        self.tflite.invoke()
-
-        boxes = self.tflite.get_tensor(self.boxes_tensor)[0]
-        classes = self.tflite.get_tensor(self.classes_tensor)[0]
-        scores = self.tflite.get_tensor(self.scores_tensor)[0]
-        num_det = self.tflite.get_tensor(self.num_det_tensor)[0]
-
-        # Draw detection boxes
-        for i in range(int(num_det)):
-            coords = boxes[i]
-            classe = int(classes[i])
-            score = scores[i]
-
-            h, w = img_orig.shape[:2]
-            ymin, xmin, ymax, xmax = coords
-            clr = _CLASS_COLORS[classe % len(_CLASS_COLORS)]
-            x1, y1 = int(xmin * w), int(ymin * h)
-            x2, y2 = int(xmax * w), int(ymax * h)
-            cv2.rectangle(img_orig, (x1, y1), (x2, y2), clr, 2)
-
-            label = self.labelmap[classe]
-            cv2.rectangle(img_orig, (x1, y1 + label['baseline']), (x1 + label['txt_w'], y1 - label['txt_h']), clr, -1)
-            cv2.putText(img_orig, label['name'], (x1, y1), _FONT_FACE, _FONT_SCALE, (0, 0, 0), _FONT_WEIGHT)
+import numpy as np
+
+import backends
+import batch
+import metadata
+import metrics
+import motion_gate
+import multistream
+import pipeline
+import tracker
+from detector import ObjectDetector, load_labels
+from renderer import DetectionRenderer
 
 
 class RtspReaderIterator:
     def __init__(self, cap):
         self.cap = cap
 
+    @metrics.timed('read')
     def __next__(self):
         if not self.cap.isOpened():
             raise StopIteration()
@@ -119,12 +57,210 @@ class RtspReader:
         return RtspReaderIterator(self.cap)
 
 
+class FfmpegReader:
+    """
+    Decodes a stream with an ffmpeg subprocess into raw frames.
+
+    Frames are read from the pipe directly into a ring of preallocated arrays,
+    so there are no per-frame allocations. A frame stays valid only until the ring wraps,
+    so `buffers` must be larger than the number of frames the consumer keeps alive at once.
+    With `buffers=0` each frame is read into a new array which the consumer owns.
+    """
+    def __init__(self, url: str, buffers: int = 1, decode_threads: int = 0, pix_fmt: str = 'bgr24'):
+        print('Init FfmpegReader')
+        if pix_fmt not in ('bgr24', 'gray'):
+            raise Exception(f'Unsupported pixel format {pix_fmt}')
+
+        transport = ['-rtsp_transport', 'tcp'] if url.startswith('rtsp://') else []
+        w, h, self.fps = self._probe(url, transport)
+        self.shape = (h, w, 3) if pix_fmt == 'bgr24' else (h, w)
+        self.buffers = [np.empty(self.shape, dtype=np.uint8) for _ in range(buffers)]
+
+        command = ['ffmpeg',
+            '-hide_banner',
+            '-loglevel', 'error',
+            *transport,
+            '-threads', str(decode_threads), # 0 means auto
+            '-i', url,
+            '-an',
+            '-f', 'rawvideo',
+            '-pix_fmt', pix_fmt,
+            '-'
+        ]
+        self.proc = subprocess.Popen(command, stdout=subprocess.PIPE)
+
+    @staticmethod
+    def _probe(url: str, transport: list):
+        command = ['ffprobe',
+            '-v', 'error',
+            *transport,
+            '-select_streams', 'v:0',
+            '-show_entries', 'stream=width,height,avg_frame_rate',
+            '-of', 'json',
+            url
+        ]
+        try:
+            stream = json.loads(subprocess.check_output(command))['streams'][0]
+        except (subprocess.CalledProcessError, IndexError, KeyError) as e:
+            raise Exception(f'Failed to open stream {url}') from e
+        num, den = stream.get('avg_frame_rate', '0/0').split('/')
+        fps = float(num) / float(den) if float(den) else 25.0
+        return stream['width'], stream['height'], fps
+
+    @metrics.timed('read')
+    def _read_into(self, buf) -> bool:
+        view = memoryview(buf).cast('B')
+        pos = 0
+        while pos < len(view):
+            n = self.proc.stdout.readinto(view[pos:])
+            if not n:
+                return False
+            pos += n
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, et, ev, t):
+        print('Close ffmpeg reader')
+        # Terminate first, closing the pipe waits for a read in progress in another thread
+        if self.proc.poll() is None:
+            self.proc.terminate()
+        self.proc.wait()
+        self.proc.stdout.close()
+
+    def __iter__(self):
+        i = 0
+        while True:
+            buf = self.buffers[i] if self.buffers else np.empty(self.shape, dtype=np.uint8)
+            if not self._read_into(buf):
+                return
+            yield buf
+            if self.buffers:
+                i = (i + 1) % len(self.buffers)
+
+
+class LatestFrameReader:
+    """
+    Drains the wrapped reader in a background thread and always gives the newest decoded frame.
+
+    When processing is slower than the camera, frames in between are skipped instead of
+    piling up in the decoder buffer, so the output latency stays bounded.
+    The wrapped reader must not reuse frame memory.
+    """
+    def __init__(self, reader):
+        print('Init LatestFrameReader')
+        self.reader = reader
+        self.fps = reader.fps
+        self.cond = threading.Condition()
+        self.frame = None
+        self.eos = False
+        self.stopped = False
+        self.grabbed = 0
+        self.skipped = 0
+        metrics.register_counter('dropped_frames_total', {'stage': 'capture'}, lambda: self.skipped)
+        self.thread = threading.Thread(target=self._grab, name='grabber', daemon=True)
+        self.thread.start()
+
+    def _grab(self):
+        try:
+            for frame in self.reader:
+                with self.cond:
+                    if self.stopped:
+                        break
+                    if self.frame is not None:
+                        self.skipped += 1
+                    self.frame = frame
+                    self.grabbed += 1
+                    self.cond.notify_all()
+        finally:
+            with self.cond:
+                self.eos = True
+                self.cond.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, et, ev, t):
+        with self.cond:
+            self.stopped = True
+        # The grabber stops after the frame being read, unless the stream has stalled
+        self.thread.join(1.0)
+        if self.thread.is_alive() and not isinstance(self.reader, FfmpegReader):
+            # OpenCV capture can't be released while another thread reads it,
+            # the grabber is a daemon thread so it doesn't keep the process anyway
+            print('Frame grabber is stalled, leave the reader open')
+        else:
+            # Closing ffmpeg reader terminates ffmpeg, so a stalled read ends
+            self.reader.__exit__(et, ev, t)
+            self.thread.join(1.0)
+        print(f'Frames grabbed: {self.grabbed}, skipped: {self.skipped}')
+
+    def __iter__(self):
+        while True:
+            with self.cond:
+                while self.frame is None and not self.eos:
+                    self.cond.wait()
+                if self.frame is None:
+                    return
+                frame, self.frame = self.frame, None
+            yield frame
+
+
 class RtspStreamer:
-    def __init__(self, rtsp_url, fps):
+    """
+    Encodes frames once and sends them to one or more comma separated outputs:
+
+    - `rtsp://...` - RTSP stream
+    - `*.m3u8` - HLS playlist, segments are written next to it and old ones are deleted
+    - a file name with a number pattern, e.g. `rec/cam1-%03d.mp4` - segmented recording,
+      with `segment_wrap` the numbers start over and the oldest files are overwritten
+    - any other file, e.g. `rec/cam1.ts`
+
+    Several outputs are fed from a single encoder by the ffmpeg tee muxer,
+    a failing output doesn't stop the others.
+
+    With `wallclock` frames are stamped with the time they are written instead of
+    the constant `fps`, so skipped frames don't make the output play faster.
+    """
+    def __init__(self, rtsp_url, fps, segment_time: int = 60, segment_wrap: int = 0, wallclock: bool = False):
         print('Init RtspStreamer')
         self.rtsp_url = rtsp_url
+        self.outputs = [url.strip() for url in rtsp_url.split(',')]
         self.proc = None
         self.fps = fps
+        self.segment_time = segment_time
+        self.segment_wrap = segment_wrap
+        self.wallclock = wallclock
+
+    def _output_options(self, url: str):
+        """
+        Returns muxer options for the output as a list of (name, value).
+        """
+        if url.startswith('rtsp://'):
+            return [('f', 'rtsp'), ('rtsp_transport', 'tcp')]
+        os.makedirs(os.path.dirname(url) or '.', exist_ok=True)
+        if url.endswith('.m3u8'):
+            return [('f', 'hls'), ('hls_time', '2'), ('hls_list_size', '5'), ('hls_flags', 'delete_segments')]
+        if '%' in url:
+            return [('f', 'segment'), ('segment_time', str(self.segment_time)),
+                ('segment_wrap', str(self.segment_wrap)), ('reset_timestamps', '1')]
+        # Let ffmpeg guess the format by file extension
+        return []
+
+    def _output_args(self):
+        if len(self.outputs) == 1:
+            url = self.outputs[0]
+            args = []
+            for name, value in self._output_options(url):
+                args += [f'-{name}', value]
+            return args + [url]
+
+        sinks = []
+        for url in self.outputs:
+            options = self._output_options(url) + [('onfail', 'ignore')]
+            sinks.append('[' + ':'.join(f'{name}={value}' for name, value in options) + ']' + url)
+        return ['-flags', '+global_header', '-map', '0:v', '-f', 'tee', '|'.join(sinks)]
 
     def start_proc(self, frame):
         frame_h = frame.shape[0]
@@ -137,29 +273,35 @@ class RtspStreamer:
                 raise Exception('Unsupported frame format')
             pix_fmt = 'bgr24'
 
+        if self.wallclock:
+            # Frames come at irregular intervals, keep them as they are without duplicating or dropping
+            timing, output_timing = ['-use_wallclock_as_timestamps', '1'], ['-vsync', 'vfr']
+        else:
+            timing, output_timing = ['-r', str(self.fps)], []
+
         command = ['ffmpeg',
             '-y',
             '-f', 'rawvideo',
             '-vcodec','rawvideo',
             '-s', f'{frame_w}x{frame_h}',
             '-pix_fmt', pix_fmt,
-            '-r', str(self.fps),
+            *timing,
             '-i', '-',
+            *output_timing,
             '-an',
             '-c:v', 'libx264',
             '-g', str(self.fps), # num frames between keyframes, set to FPS to get 1sec
             '-preset', 'superfast',
             '-tune', 'zerolatency',
-            '-f', 'rtsp',
-            '-rtsp_transport', 'tcp',
-            f'{self.rtsp_url}'
-        ]
+        ] + self._output_args()
         self.proc = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.STDOUT)
 
+    @metrics.timed('write')
     def write(self, frame):
         if not self.proc:
             self.start_proc(frame)
-        self.proc.stdin.write(frame.tostring())
+        # Pass the frame memory as is, without making a bytes copy of it
+        self.proc.stdin.write(memoryview(np.ascontiguousarray(frame)).cast('B'))
 
     def __enter__(self):
         return self
@@ -171,10 +313,11 @@ class RtspStreamer:
             self.proc.wait()
 
 
-def _detect_img_file(img_in: str, img_out: str, target_w: int):
+def _detect_img_file(make_detector, img_in: str, img_out: str, target_w: int):
     img = cv2.imread(img_in)
 
-    ObjectDetector().detect(img)
+    detector = make_detector()
+    DetectionRenderer(detector.labels).draw(img, detector.detect(img))
 
     if target_w:
         img = _resize_image(img, target_w)
@@ -194,6 +337,15 @@ def _detect_img_file(img_in: str, img_out: str, target_w: int):
     cv2.destroyAllWindows()
 
 
+def _detect_img_batch(make_detector, source: str, output: str, decode_workers: int, pool_size: int, annotate_dir: str):
+    if not output:
+        raise Exception('Output JSONL file is not specified, use "-" for stdout')
+    renderer = DetectionRenderer(load_labels()) if annotate_dir else None
+    detector = batch.BatchDetector(make_detector, decode_workers, pool_size, renderer=renderer, annotate_dir=annotate_dir)
+    detector.run(source, output)
+
+
+@metrics.timed('resize')
 def _resize_image(frame, target_w: int):
     if not target_w:
         return frame
@@ -204,54 +356,235 @@ def _resize_image(frame, target_w: int):
     return cv2.resize(frame, (target_w, target_h))
 
 
-def _detect_rtsp__window(rtsp_url: str, target_w: int):
-    tflite = ObjectDetector()
-    with RtspReader(rtsp_url) as rtsp:
+def _make_tracked_detector(make_detector, detect_every: int, latency_budget: float, motion: str):
+    return tracker.TrackedDetector(make_detector(), detect_every, latency_budget, motion)
+
+
+def _make_gated_detector(make_detector, threshold: float):
+    return motion_gate.GatedDetector(make_detector(), threshold)
+
+
+def _input_opener(reader: str, decode_threads: int, latest: bool):
+    def open_input(url: str, buffers: int = 1):
+        if latest:
+            # Frames are handed over between threads, so they can't share memory
+            inner = FfmpegReader(url, 0, decode_threads) if reader == 'ffmpeg' else RtspReader(url)
+            return LatestFrameReader(inner)
+        if reader == 'ffmpeg':
+            return FfmpegReader(url, buffers, decode_threads)
+        return RtspReader(url)
+    return open_input
+
+
+def _print_detector_stats(detector):
+    if hasattr(detector, 'print_stats'):
+        detector.print_stats()
+
+
+def _detect_rtsp__window(make_detector, open_input, rtsp_url: str, target_w: int):
+    tflite = make_detector()
+    renderer = DetectionRenderer(tflite.labels)
+    with open_input(rtsp_url) as rtsp:
         for frame in rtsp:
+            start_time = time.perf_counter()
             frame = _resize_image(frame, target_w)
 
-            tflite.detect(frame)
+            renderer.draw(frame, tflite.detect(frame))
 
             cv2.imshow('frame', frame)
+            metrics.observe_frame_age(start_time)
             if cv2.waitKey(20) & 0xFF == ord('q'):
                 break
     cv2.destroyAllWindows()
-
-
-def _detect_rtsp__restream(rtsp_in: str, rtsp_out: str, target_w: int):
-    tflite = ObjectDetector()
-    with RtspReader(rtsp_in) as rtsp:
-         with RtspStreamer(rtsp_out, rtsp.fps) as streamer:
-            for frame in rtsp:
-                frame = _resize_image(frame, target_w)
-                tflite.detect(frame)
+    _print_detector_stats(tflite)
+
+
+def _detect_rtsp__restream(make_detector, open_input, open_output, rtsp_in: str, rtsp_out: str, target_w: int):
+    tflite = make_detector()
+    renderer = DetectionRenderer(tflite.labels)
+    with open_input(rtsp_in) as rtsp:
+         with open_output(rtsp_out, rtsp.fps) as streamer:
+            try:
+                for frame in rtsp:
+                    start_time = time.perf_counter()
+                    frame = _resize_image(frame, target_w)
+                    renderer.draw(frame, tflite.detect(frame))
+                    streamer.write(frame)
+                    metrics.observe_frame_age(start_time)
+            finally:
+                _print_detector_stats(tflite)
+
+
+def _detect_rtsp__metadata(make_detector, open_input, rtsp_in: str, output: str, fmt: str):
+    """
+    Publishes detections only, frames are not resized, drawn or encoded, boxes are in source frame pixels.
+    """
+    tflite = make_detector()
+    with open_input(rtsp_in) as rtsp:
+        with metadata.MetadataWriter(output, fmt, tflite.labels) as writer:
+            try:
+                for frame_index, frame in enumerate(rtsp):
+                    start_time = time.perf_counter()
+                    timestamp = time.time()
+                    writer.write(frame_index, timestamp, tflite.detect(frame))
+                    metrics.observe_frame_age(start_time)
+            finally:
+                _print_detector_stats(tflite)
+
+
+def _detect_rtsp__restream_pipelined(make_detector, open_input, open_output, rtsp_in: str, rtsp_out: str, target_w: int, queue_size: int, overflow: str):
+    tflite = make_detector()
+    renderer = DetectionRenderer(tflite.labels)
+
+    # Frames travel through the stages along with their decoding time
+    def read(rtsp):
+        for frame in rtsp:
+            start_time = time.perf_counter()
+            yield _resize_image(frame, target_w), start_time
+
+    def detect(job):
+        frame, start_time = job
+        return frame, start_time, tflite.detect(frame)
+
+    def draw(job):
+        frame, start_time, det = job
+        renderer.draw(frame, det)
+        return frame, start_time
+
+    if overflow != pipeline.OVERFLOW_BLOCK:
+        # Frames are dropped by queues, stamped at the source frame rate the output would play faster
+        open_output = functools.partial(open_output, wallclock=True)
+
+    # Stages hold frames in other threads and queues may drop them, so the reader
+    # never knows when a frame is free, each frame gets its own memory
+    with open_input(rtsp_in, 0) as rtsp:
+        with open_output(rtsp_out, rtsp.fps) as streamer:
+            def write(job):
+                frame, start_time = job
                 streamer.write(frame)
+                metrics.observe_frame_age(start_time)
+
+            stages = [('detect', detect), ('draw', draw), ('write', write)]
+            p = pipeline.Pipeline(read(rtsp), stages, queue_size, overflow)
+            for (name, _), q in zip(stages, p.queues):
+                metrics.register_gauge('queue_depth', {'queue': name}, q.__len__)
+                metrics.register_counter('dropped_frames_total', {'queue': name}, lambda q=q: q.dropped)
+            try:
+                p.run()
+            finally:
+                p.print_stats()
+                _print_detector_stats(tflite)
+
+
+def _detect_rtsp__multistream(make_detector, open_input, open_output, streams_file: str, target_w: int, pool_size: int, max_fps: float):
+    channels = multistream.load_channels(streams_file, max_fps)
+    renderer = DetectionRenderer(load_labels())
+    # Streams which aren't served fast enough skip frames, stamped at the source frame rate their output would play faster
+    open_output = functools.partial(open_output, wallclock=True)
+    # Readers replace pending frames while workers may still be detecting them, so frames can't share memory
+    server = multistream.MultiStreamServer(channels, make_detector, lambda url: open_input(url, 0), open_output,
+        pool_size, lambda frame: _resize_image(frame, target_w), renderer.draw)
+    server.run()
+
+
+def _main(default_backend: str = 'tflite'):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', help='input image, directory, glob pattern, @list file or rtsp stream', nargs='?')
+    parser.add_argument('-o', '--output', help='output image file, JSONL file, or comma separated rtsp streams, video files and HLS playlists')
+    parser.add_argument('-r', '--resize', help='resize video frame to this width', type=int)
+    parser.add_argument('--metadata', help='write only detections of RTSP frames to the output file, - for stdout, unix:/path or tcp://host:port', choices=metadata.FORMATS)
+    parser.add_argument('--segment-time', help='duration of video file segments, seconds', type=int, default=60)
+    parser.add_argument('--segment-wrap', help='number of video file segments to keep rotating, 0 means keep all', type=int, default=0)
+    parser.add_argument('-p', '--pipeline', help='run decode, detection and encode of RTSP restream in separate threads', action='store_true')
+    parser.add_argument('--queue-size', help='max number of frames queued between pipeline stages', type=int, default=2)
+    parser.add_argument('--overflow', help='what to do when a pipeline queue is full', choices=pipeline.OVERFLOW_POLICIES, default=pipeline.OVERFLOW_BLOCK)
+    parser.add_argument('-s', '--streams', help='file with a list of "rtsp_in rtsp_out [max_fps]" lines to process in one process')
+    parser.add_argument('--pool', help='number of detectors shared by all streams or images', type=int, default=os.cpu_count())
+    parser.add_argument('--max-fps', help='default per-stream FPS cap, 0 means no cap', type=float, default=0)
+    parser.add_argument('-t', '--threshold', help='min score of detections to keep', type=float, default=0.5)
+    parser.add_argument('-c', '--classes', help='comma separated list of class names to keep, e.g. "person,car"')
+    parser.add_argument('--reader', help='how to decode RTSP streams', choices=['opencv', 'ffmpeg'], default='opencv')
+    parser.add_argument('--decode-threads', help='number of ffmpeg decoder threads, 0 means auto', type=int, default=0)
+    parser.add_argument('--latest', help='always process the newest RTSP frame, skip frames decoded while the previous one was processed', action='store_true')
+    parser.add_argument('--letterbox', help='keep aspect ratio of frames when resizing them to the model input', action='store_true')
+    parser.add_argument('-n', '--detect-every', help='run the detector only on every N-th frame of RTSP stream and track boxes in between', type=int, default=0)
+    parser.add_argument('--latency-budget', help='run the detector as often as its time spread over tracked frames fits this budget, ms per frame', type=float, default=0)
+    parser.add_argument('--motion', help='how to move tracked boxes between detections', choices=tracker.MOTION_MODELS, default=tracker.MOTION_VELOCITY)
+    parser.add_argument('-g', '--motion-gate', help='skip detection on RTSP frames where less than this fraction of pixels changed, e.g. 0.005', type=float, default=0)
+    parser.add_argument('-b', '--backend', help='inference backend', choices=list(backends.BACKENDS), default=default_backend)
+    parser.add_argument('-m', '--model', help='model file, default is the tuned one or depends on backend')
+    parser.add_argument('--threads', help='number of inference threads per detector, 0 means tuned or backend default', type=int, default=0)
+    parser.add_argument('--no-xnnpack', help='disable XNNPACK delegate', action='store_true')
+    parser.add_argument('--decode-workers', help='number of threads decoding images in batch mode', type=int, default=os.cpu_count())
+    parser.add_argument('--annotate', help='directory to save images with detection boxes in batch mode')
+    parser.add_argument('--metrics-port', help='serve per-stage latency metrics in Prometheus format on this local port', type=int, default=0)
+    parser.add_argument('--metrics-interval', help='print a metrics summary line every this many seconds', type=float, default=0)
+    args = parser.parse_args()
 
+    if args.output == '-':
+        # Keep stdout clean for the results, log messages go to stderr
+        sys.stdout = sys.stderr
 
-def _main():
     print('Sample box detector')
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument('input', help='input image or rtsp stream')
-    parser.add_argument('-o', '--output', help='output image sile or rtsp stream')
-    parser.add_argument('-r', '--resize', help='resize video frame to this width', type=int)
-    args = parser.parse_args()
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+    if args.metrics_interval:
+        metrics.start_reporter(args.metrics_interval)
+
+    classes = [name.strip() for name in args.classes.split(',')] if args.classes else None
+    make_detector = functools.partial(ObjectDetector, args.threshold, classes, args.letterbox,
+        args.backend, args.model, args.threads, False if args.no_xnnpack else None)
+    open_input = _input_opener(args.reader, args.decode_threads, args.latest)
+    open_output = functools.partial(RtspStreamer, segment_time=args.segment_time, segment_wrap=args.segment_wrap, wallclock=args.latest)
+
+    tracking = args.detect_every > 1 or args.latency_budget > 0
+    if tracking:
+        make_detector = functools.partial(_make_tracked_detector, make_detector, args.detect_every, args.latency_budget / 1000.0, args.motion)
+
+    if args.motion_gate > 0:
+        make_detector = functools.partial(_make_gated_detector, make_detector, args.motion_gate)
+
+    if args.streams:
+        if tracking or args.motion_gate > 0:
+            raise Exception('Tracking and motion gate are not supported for multiple streams, detectors are shared between them')
+        print(f'Detecting RTSP streams from {args.streams} (target_w={args.resize}, pool={args.pool}, max_fps={args.max_fps})')
+        _detect_rtsp__multistream(make_detector, open_input, open_output, args.streams, args.resize, args.pool, args.max_fps)
+        return
 
     if not args.input:
         raise Exception('Input source is not specified')
 
     if args.input.startswith('rtsp://'):
+        if args.metadata:
+            if not args.output:
+                raise Exception('Output is required for metadata')
+            print(f'Detecting RTSP: {args.input} -> {args.output} (metadata={args.metadata})')
+            _detect_rtsp__metadata(make_detector, open_input, args.input, args.output, args.metadata)
+            return
+
         if args.output:
+            if args.pipeline:
+                print(f'Detecting RTSP: {args.input} -> {args.output} (target_w={args.resize}, pipelined, queue_size={args.queue_size}, overflow={args.overflow})')
+                _detect_rtsp__restream_pipelined(make_detector, open_input, open_output, args.input, args.output, args.resize, args.queue_size, args.overflow)
+                return
             print(f'Detecting RTSP: {args.input} -> {args.output} (target_w={args.resize})')
-            _detect_rtsp__restream(args.input, args.output, args.resize)
+            _detect_rtsp__restream(make_detector, open_input, open_output, args.input, args.output, args.resize)
             return
 
         print(f'Detecting RTSP: {args.input} -> window (target_w={args.resize})')
-        _detect_rtsp__window(args.input, args.resize)
+        _detect_rtsp__window(make_detector, open_input, args.input, args.resize)
+        return
+
+    if batch.is_batch_source(args.input):
+        if tracking or args.motion_gate > 0:
+            raise Exception('Tracking and motion gate are not supported for images, they work on consecutive video frames')
+        print(f'Detecting images: {args.input} -> {args.output} (decode_workers={args.decode_workers}, pool={args.pool})')
+        _detect_img_batch(make_detector, args.input, args.output, args.decode_workers, args.pool, args.annotate)
         return
 
     print(f'Detecting image: {args.input} -> {args.output or "window"}')
-    _detect_img_file(args.input, args.output, args.resize)
+    _detect_img_file(make_detector, args.input, args.output, args.resize)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,98 @@
+import json
+import socket
+import struct
+import sys
+import numpy as np
+
+import metrics
+from detections import Detections
+
+
+FORMAT_JSONL = 'jsonl'
+FORMAT_BINARY = 'binary'
+FORMATS = [FORMAT_JSONL, FORMAT_BINARY]
+
+# Binary record: frame header followed by `count` detections, all little-endian
+FRAME_HEADER = struct.Struct('<dIH') # timestamp (unix time, seconds), frame index, count
+DETECTION_DTYPE = np.dtype([('box', '<i2', 4), ('class_id', '<u2'), ('score', '<f4')]) # box is x1, y1, x2, y2
+
+
+def _open_output(output: str):
+    """
+    Opens a binary stream for `-` (stdout), `unix:/path/to.sock`, `tcp://host:port` or a file name.
+    Sockets are connected as a client, the consumer is expected to listen.
+    """
+    if output == '-':
+        return sys.__stdout__.buffer
+    if output.startswith('unix:'):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(output[len('unix:'):])
+        return sock.makefile('wb')
+    if output.startswith('tcp://'):
+        host, port = output[len('tcp://'):].rsplit(':', 1)
+        sock = socket.create_connection((host, int(port)))
+        return sock.makefile('wb')
+    return open(output, 'wb')
+
+
+class MetadataWriter:
+    """
+    Writes detections of each frame as a JSON line or a compact binary record.
+    Records are flushed at once so consumers get them without delay.
+    """
+    def __init__(self, output: str, fmt: str, labels: list):
+        print(f'Init MetadataWriter ({fmt})')
+        if fmt not in FORMATS:
+            raise Exception(f'Unsupported metadata format {fmt}')
+        self.output = output
+        self.fmt = fmt
+        self.labels = labels
+        self.out = _open_output(output)
+        self.records = np.empty(0, dtype=DETECTION_DTYPE)
+
+    def _jsonl(self, frame_index: int, timestamp: float, det: Detections) -> bytes:
+        record = {
+            'ts': round(timestamp, 3),
+            'frame': frame_index,
+            'detections': det.to_records(self.labels),
+        }
+        return (json.dumps(record) + '\n').encode()
+
+    def _binary(self, frame_index: int, timestamp: float, det: Detections) -> bytes:
+        n = len(det)
+        if len(self.records) < n:
+            self.records = np.empty(n, dtype=DETECTION_DTYPE)
+        records = self.records[:n]
+        records['box'] = det.boxes
+        records['class_id'] = det.classes
+        records['score'] = det.scores
+        return FRAME_HEADER.pack(timestamp, frame_index, n) + records.tobytes()
+
+    @metrics.timed('write')
+    def write(self, frame_index: int, timestamp: float, det: Detections):
+        if self.fmt == FORMAT_JSONL:
+            self.out.write(self._jsonl(frame_index, timestamp, det))
+        else:
+            self.out.write(self._binary(frame_index, timestamp, det))
+        self.out.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, et, ev, t):
+        print('Close metadata writer')
+        if self.output != '-':
+            self.out.close()
+
+
+def read_binary(stream):
+    """
+    Reads binary records written by MetadataWriter, yields (timestamp, frame_index, detections array).
+    """
+    while True:
+        header = stream.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            return
+        timestamp, frame_index, count = FRAME_HEADER.unpack(header)
+        data = stream.read(count * DETECTION_DTYPE.itemsize)
+        yield timestamp, frame_index, np.frombuffer(data, dtype=DETECTION_DTYPE)
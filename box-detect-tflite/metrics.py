@@ -0,0 +1,226 @@
+import bisect
+import contextlib
+import functools
+import http.server
+import threading
+import time
+
+
+# Upper bounds of histogram buckets, seconds
+_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_PREFIX = 'detector_'
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Collects per-stage latency histograms, end-to-end frame age, and gauges and counters
+    (queue depths, dropped frames) read from callbacks at scrape time.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {} # stage -> Histogram
+        self.frame_age = Histogram()
+        self.frames = 0
+        self.gauges = [] # (name, labels, fn)
+        self.counters = [] # (name, labels, fn)
+        self.last_report = (time.monotonic(), {})
+
+    def observe(self, stage: str, seconds: float):
+        with self.lock:
+            hist = self.stages.get(stage)
+            if hist is None:
+                hist = self.stages[stage] = Histogram()
+            hist.observe(seconds)
+
+    def observe_frame_age(self, seconds: float):
+        with self.lock:
+            self.frame_age.observe(seconds)
+            self.frames += 1
+
+    def register_gauge(self, name: str, labels: dict, fn):
+        with self.lock:
+            self.gauges.append((name, labels, fn))
+
+    def register_counter(self, name: str, labels: dict, fn):
+        with self.lock:
+            self.counters.append((name, labels, fn))
+
+    def render(self) -> str:
+        """
+        Returns all metrics in Prometheus text exposition format.
+        """
+        lines = []
+
+        def histogram(name, help, hist, labels):
+            lines.append(f'# HELP {_PREFIX}{name} {help}')
+            lines.append(f'# TYPE {_PREFIX}{name} histogram')
+            for label, h in hist:
+                cumulative = 0
+                for bound, count in zip(_BUCKETS + ('+Inf',), h.counts):
+                    cumulative += count
+                    lines.append(f'{_PREFIX}{name}_bucket{_labels(labels(label), le=bound)} {cumulative}')
+                lines.append(f'{_PREFIX}{name}_sum{_labels(labels(label))} {h.sum}')
+                lines.append(f'{_PREFIX}{name}_count{_labels(labels(label))} {h.count}')
+
+        def callbacks(kind, items):
+            for name in sorted(set(name for name, _, _ in items)):
+                lines.append(f'# TYPE {_PREFIX}{name} {kind}')
+                for n, labels, fn in items:
+                    if n == name:
+                        lines.append(f'{_PREFIX}{name}{_labels(labels)} {fn()}')
+
+        with self.lock:
+            histogram('stage_latency_seconds', 'Latency of pipeline stages per frame',
+                sorted(self.stages.items()), lambda stage: {'stage': stage})
+            histogram('frame_age_seconds', 'Time from frame decoding to its output',
+                [(None, self.frame_age)], lambda _: {})
+            callbacks('gauge', self.gauges)
+            callbacks('counter', self.counters)
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        """
+        Returns a one line summary of average stage latencies since the previous call.
+        """
+        now = time.monotonic()
+        with self.lock:
+            current = {stage: (h.sum, h.count) for stage, h in self.stages.items()}
+            current['frame_age'] = (self.frame_age.sum, self.frame_age.count)
+            last_time, last = self.last_report
+            self.last_report = (now, current)
+            dropped = sum(fn() for name, _, fn in self.counters if name == 'dropped_frames_total')
+
+        parts = []
+        for stage, (total, count) in current.items():
+            prev_total, prev_count = last.get(stage, (0.0, 0))
+            if count > prev_count:
+                parts.append(f'{stage} {1000.0 * (total - prev_total) / (count - prev_count):.1f} ms')
+        frames = current['frame_age'][1] - last.get('frame_age', (0.0, 0))[1]
+        fps = frames / (now - last_time) if now > last_time else 0.0
+        parts.append(f'fps {fps:.1f}')
+        parts.append(f'dropped {dropped}')
+        return ' | '.join(parts)
+
+
+def _labels(labels: dict, **extra) -> str:
+    labels = {**labels, **extra}
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+
+
+# Metrics are collected only when enabled, otherwise all helpers below are no-op
+REGISTRY = None
+
+
+def enable() -> Metrics:
+    global REGISTRY
+    if REGISTRY is None:
+        REGISTRY = Metrics()
+    return REGISTRY
+
+
+def observe(stage: str, seconds: float):
+    if REGISTRY:
+        REGISTRY.observe(stage, seconds)
+
+
+def observe_frame_age(start_time: float):
+    """
+    Records age of a frame which was decoded at `start_time` (time.perf_counter) and just got to the output.
+    """
+    if REGISTRY:
+        REGISTRY.observe_frame_age(time.perf_counter() - start_time)
+
+
+def register_gauge(name: str, labels: dict, fn):
+    if REGISTRY:
+        REGISTRY.register_gauge(name, labels, fn)
+
+
+def register_counter(name: str, labels: dict, fn):
+    if REGISTRY:
+        REGISTRY.register_counter(name, labels, fn)
+
+
+@contextlib.contextmanager
+def timer(stage: str):
+    if not REGISTRY:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        REGISTRY.observe(stage, time.perf_counter() - start_time)
+
+
+def timed(stage: str):
+    """
+    Decorator recording duration of each call as latency of the stage.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not REGISTRY:
+                return fn(*args, **kwargs)
+            start_time = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                REGISTRY.observe(stage, time.perf_counter() - start_time)
+        return wrapper
+    return decorator
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int, host: str = '127.0.0.1'):
+    """
+    Serves metrics on http://host:port/metrics in a background thread.
+    """
+    enable()
+    server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    print(f'Serving metrics on http://{host}:{port}/metrics')
+    return server
+
+
+def start_reporter(interval: float):
+    """
+    Prints a summary line every `interval` seconds in a background thread.
+    """
+    registry = enable()
+
+    def report():
+        while True:
+            time.sleep(interval)
+            print(f'Metrics: {registry.summary()}')
+
+    threading.Thread(target=report, name='metrics-report', daemon=True).start()
@@ -0,0 +1,46 @@
+import json
+import os
+
+
+_MODELS_DIR = '../models/ssd_mobilenet_v1'
+
+# File with the configuration chosen by `tune.py`, it is used by ObjectDetector by default
+TUNED_FILE = 'tuned.json'
+
+
+class ModelInfo:
+    def __init__(self, file: str, input_size: int, quantized: bool, description: str):
+        self.file = file
+        self.input_size = input_size
+        self.quantized = quantized
+        self.description = description
+
+
+# TFLite SSD models with the detection postprocessing op and COCO labels of `labelmap.txt`.
+# Only the first one is bundled, others are downloaded by `../models/ssd_mobilenet_v1/get.sh`.
+MODELS = {
+    'ssd_mobilenet_v1_uint8_300': ModelInfo(f'{_MODELS_DIR}/mobilenet.tflite', 300, True,
+        'SSD MobileNet V1, quantized'),
+    'ssd_mobilenet_v3_small_float_320': ModelInfo(f'{_MODELS_DIR}/ssd_mobilenet_v3_small_coco_2020_01_14/model.tflite', 320, False,
+        'SSD MobileNet V3 small, float'),
+    'ssd_mobilenet_v3_large_float_320': ModelInfo(f'{_MODELS_DIR}/ssd_mobilenet_v3_large_coco_2020_01_14/model.tflite', 320, False,
+        'SSD MobileNet V3 large, float'),
+    'ssd_mobiledet_cpu_float_320': ModelInfo(f'{_MODELS_DIR}/ssd_mobiledet_cpu_coco/model.tflite', 320, False,
+        'SSD MobileDet tuned for CPU, float'),
+}
+
+
+def load_tuned():
+    """
+    Returns the saved tuned configuration as a dict of `backend`, `model`, `threads`, `xnnpack`, or None.
+    """
+    if not os.path.exists(TUNED_FILE):
+        return None
+    with open(TUNED_FILE) as f:
+        return json.load(f)
+
+
+def save_tuned(config: dict):
+    with open(TUNED_FILE, 'w') as f:
+        json.dump(config, f, indent=2)
+    print(f'Tuned configuration saved to {TUNED_FILE}')
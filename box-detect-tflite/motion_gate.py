@@ -0,0 +1,78 @@
+import cv2
+import numpy as np
+
+
+# Frames are compared at this width, that's enough to notice a person in a corridor
+_GATE_WIDTH = 160
+
+
+class MotionGate:
+    """
+    Tells if a frame differs enough from the running background.
+
+    Frames are downscaled, converted to gray and blurred to suppress noise,
+    then compared with the background which slowly adapts to lighting changes.
+    A frame is considered changed when the fraction of pixels differing
+    by more than `pixel_threshold` reaches `threshold`.
+    """
+    def __init__(self, threshold: float, pixel_threshold: int = 25, adapt_rate: float = 0.05):
+        self.threshold = threshold
+        self.pixel_threshold = pixel_threshold
+        self.adapt_rate = adapt_rate
+        self.background = None
+        self.size = None
+        self.fraction = 0.0
+
+    def _small_gray(self, frame):
+        h, w = frame.shape[:2]
+        if self.size is None:
+            scale = min(1.0, _GATE_WIDTH / w)
+            self.size = (max(round(w * scale), 1), max(round(h * scale), 1))
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def changed(self, frame) -> bool:
+        gray = self._small_gray(frame)
+        if self.background is None:
+            self.background = gray.astype(np.float32)
+            self.fraction = 1.0
+            return True
+
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self.background))
+        self.fraction = np.count_nonzero(diff > self.pixel_threshold) / diff.size
+        cv2.accumulateWeighted(gray, self.background, self.adapt_rate)
+        return self.fraction >= self.threshold
+
+
+class GatedDetector:
+    """
+    Runs the wrapped detector only on frames where the motion gate sees changes,
+    other frames get the last detection result.
+    """
+    def __init__(self, detector, threshold: float):
+        self.detector = detector
+        self.labels = detector.labels
+        self.gate = MotionGate(threshold)
+        self.last_result = None
+        self.inferred = 0
+        self.skipped = 0
+
+    def detect(self, frame):
+        if self.last_result is not None and not self.gate.changed(frame):
+            self.skipped += 1
+            return self.last_result
+        if self.last_result is None:
+            # Initialize the background
+            self.gate.changed(frame)
+        self.last_result = self.detector.detect(frame)
+        self.inferred += 1
+        return self.last_result
+
+    def print_stats(self):
+        total = self.inferred + self.skipped
+        skipped = 100.0 * self.skipped / total if total else 0.0
+        print(f'Motion gate: inferred {self.inferred}, skipped {self.skipped} ({skipped:.1f}%)')
+        if hasattr(self.detector, 'print_stats'):
+            self.detector.print_stats()
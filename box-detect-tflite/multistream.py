@@ -0,0 +1,201 @@
+import math
+import threading
+import time
+
+import metrics
+
+
+class StreamChannel:
+    def __init__(self, index: int, rtsp_in: str, rtsp_out: str, max_fps: float = 0):
+        self.index = index
+        self.rtsp_in = rtsp_in
+        self.rtsp_out = rtsp_out
+        self.max_fps = max_fps
+        self.streamer = None
+
+        # State shared between the reader thread and the detection workers,
+        # guarded by the server condition
+        self.frame = None # newest decoded frame not yet scheduled
+        self.frame_time = 0.0 # when the frame was decoded
+        self.busy = False # a frame of this channel is being detected
+        self.eos = False # reader has reached the end of the stream
+        self.failed = False # detecting or writing a frame failed, the reader stops
+        self.finished = False
+        self.next_time = 0.0
+
+        self.decoded = 0
+        self.processed = 0
+        self.skipped = 0
+
+    @property
+    def period(self):
+        return 1.0 / self.max_fps if self.max_fps else 0.0
+
+    def __str__(self):
+        return f'[{self.index}] {self.rtsp_in} -> {self.rtsp_out}'
+
+
+def load_channels(file_name: str, max_fps: float = 0):
+    """
+    Reads a list of streams, one per line: `rtsp_in rtsp_out [max_fps]`.
+    Empty lines and lines starting with # are ignored.
+    """
+    channels = []
+    with open(file_name) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            parts = line.split()
+            if len(parts) not in (2, 3):
+                raise Exception(f'Invalid stream line: {line}')
+            fps = float(parts[2]) if len(parts) == 3 else max_fps
+            channels.append(StreamChannel(len(channels), parts[0], parts[1], fps))
+    if not channels:
+        raise Exception(f'No streams found in {file_name}')
+    return channels
+
+
+class MultiStreamServer:
+    """
+    Processes many RTSP streams in a single process.
+
+    Each stream has its own reader thread which keeps only the newest decoded frame.
+    A fixed pool of workers, each owning its own detector (interpreters are not thread-safe),
+    takes frames from the streams in round-robin order, so every stream gets a fair share
+    of the pool regardless of its FPS. A stream is never scheduled to two workers at once
+    which keeps its output frames in order, and it is not scheduled more often than its FPS cap.
+    """
+    def __init__(self, channels, make_detector, open_input, open_output, pool_size: int, prepare=None, draw=None):
+        self.channels = channels
+        self.make_detector = make_detector
+        self.open_input = open_input
+        self.open_output = open_output
+        self.pool_size = pool_size
+        self.prepare = prepare
+        self.draw = draw
+        self.cond = threading.Condition()
+        self.next_channel = 0
+        self.stopped = False
+        self.error = None
+
+    def _read(self, ch: StreamChannel):
+        try:
+            with self.open_input(ch.rtsp_in) as rtsp:
+                fps = min(ch.max_fps, rtsp.fps) if ch.max_fps else rtsp.fps
+                with self.open_output(ch.rtsp_out, fps) as streamer:
+                    ch.streamer = streamer
+                    for frame in rtsp:
+                        frame_time = time.perf_counter()
+                        if self.prepare:
+                            frame = self.prepare(frame)
+                        with self.cond:
+                            if self.stopped or ch.failed:
+                                break
+                            if ch.frame is not None:
+                                ch.skipped += 1
+                            ch.frame = frame
+                            ch.frame_time = frame_time
+                            ch.decoded += 1
+                            self.cond.notify_all()
+
+                    # Let the workers finish with this channel before closing the output
+                    with self.cond:
+                        ch.eos = True
+                        self.cond.notify_all()
+                        while (ch.busy or ch.frame is not None) and not self.stopped:
+                            self.cond.wait()
+        except Exception as e:
+            print(f'Stream {ch} failed: {e}')
+        finally:
+            with self.cond:
+                ch.finished = True
+                ch.frame = None
+                self.cond.notify_all()
+
+    def _schedule(self):
+        with self.cond:
+            while not self.stopped:
+                if all(ch.finished for ch in self.channels):
+                    return None
+                now = time.monotonic()
+                wait = math.inf
+                n = len(self.channels)
+                for k in range(n):
+                    i = (self.next_channel + k) % n
+                    ch = self.channels[i]
+                    if ch.frame is None or ch.busy:
+                        continue
+                    if ch.next_time > now:
+                        wait = min(wait, ch.next_time - now)
+                        continue
+                    self.next_channel = (i + 1) % n
+                    frame, ch.frame = ch.frame, None
+                    ch.busy = True
+                    ch.next_time = max(ch.next_time + ch.period, now)
+                    return ch, frame, ch.frame_time
+                self.cond.wait(None if wait == math.inf else wait)
+            return None
+
+    def _work(self, index: int):
+        try:
+            detector = self.make_detector()
+            while True:
+                job = self._schedule()
+                if not job:
+                    break
+                ch, frame, frame_time = job
+                try:
+                    det = detector.detect(frame)
+                    if self.draw:
+                        self.draw(frame, det)
+                    ch.streamer.write(frame)
+                    metrics.observe_frame_age(frame_time)
+                except Exception as e:
+                    # E.g. the output ffmpeg has exited, only this stream is stopped
+                    print(f'Stream {ch} failed: {e}')
+                    with self.cond:
+                        ch.failed = True
+                        ch.frame = None
+                finally:
+                    with self.cond:
+                        ch.busy = False
+                        ch.processed += 1
+                        self.cond.notify_all()
+        except BaseException as e:
+            with self.cond:
+                if self.error is None:
+                    self.error = e
+            self.stop()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def run(self):
+        print(f'Starting {len(self.channels)} streams on {self.pool_size} detectors')
+        for ch in self.channels:
+            metrics.register_gauge('queue_depth', {'stream': ch.index}, lambda ch=ch: int(ch.frame is not None))
+            metrics.register_counter('dropped_frames_total', {'stream': ch.index}, lambda ch=ch: ch.skipped)
+        threads = [threading.Thread(target=self._work, args=(i,), name=f'detector-{i}', daemon=True) for i in range(self.pool_size)]
+        threads += [threading.Thread(target=self._read, args=(ch,), name=f'reader-{ch.index}', daemon=True) for ch in self.channels]
+        for t in threads:
+            t.start()
+        try:
+            for t in threads:
+                # Join with timeout to keep the main thread responsive to Ctrl+C
+                while t.is_alive():
+                    t.join(0.5)
+        except KeyboardInterrupt:
+            self.stop()
+            raise
+        finally:
+            self.print_stats()
+        if self.error:
+            raise self.error
+
+    def print_stats(self):
+        for ch in self.channels:
+            status = ', failed' if ch.failed else ''
+            print(f'Stream {ch}: decoded {ch.decoded}, processed {ch.processed}, skipped {ch.skipped}{status}')
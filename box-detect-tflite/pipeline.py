@@ -0,0 +1,172 @@
+import collections
+import threading
+
+
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_OLDEST = 'drop-oldest'
+OVERFLOW_DROP_NEWEST = 'drop-newest'
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST)
+
+
+class QueueClosed(Exception):
+    pass
+
+
+class FrameQueue:
+    """
+    Bounded queue between two pipeline stages.
+
+    When the queue is full, `put` either waits for a free slot (block),
+    evicts the oldest queued item (drop-oldest) or discards the new item (drop-newest).
+    `close` marks the end of the stream: consumers still get the items already queued.
+    `abort` discards everything and wakes up both sides immediately.
+    """
+    def __init__(self, size: int, overflow: str = OVERFLOW_BLOCK):
+        if size < 1:
+            raise Exception(f'Invalid queue size {size}')
+        if overflow not in OVERFLOW_POLICIES:
+            raise Exception(f'Unsupported overflow policy {overflow}')
+        self.size = size
+        self.overflow = overflow
+        self.items = collections.deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self.cond:
+            while len(self.items) >= self.size and not self.closed:
+                if self.overflow == OVERFLOW_DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                if self.overflow == OVERFLOW_DROP_OLDEST:
+                    self.items.popleft()
+                    self.dropped += 1
+                    break
+                self.cond.wait()
+            if self.closed:
+                raise QueueClosed()
+            self.items.append(item)
+            self.cond.notify_all()
+            return True
+
+    def get(self):
+        with self.cond:
+            while not self.items:
+                if self.closed:
+                    raise QueueClosed()
+                self.cond.wait()
+            item = self.items.popleft()
+            self.cond.notify_all()
+            return item
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def abort(self):
+        with self.cond:
+            self.items.clear()
+            self.closed = True
+            self.cond.notify_all()
+
+    def __len__(self):
+        with self.cond:
+            return len(self.items)
+
+
+class _Worker(threading.Thread):
+    def __init__(self, pipeline, name, fn, inbox, outbox):
+        super().__init__(name=name, daemon=True)
+        self.pipeline = pipeline
+        self.fn = fn
+        self.inbox = inbox
+        self.outbox = outbox
+        self.processed = 0
+
+    def _items(self):
+        if isinstance(self.inbox, FrameQueue):
+            while True:
+                try:
+                    yield self.inbox.get()
+                except QueueClosed:
+                    return
+        else:
+            yield from self.inbox
+
+    def run(self):
+        try:
+            for item in self._items():
+                if self.pipeline.aborted:
+                    break
+                result = self.fn(item) if self.fn else item
+                self.processed += 1
+                if self.outbox is not None:
+                    self.outbox.put(result)
+        except QueueClosed:
+            # Downstream has been aborted
+            pass
+        except BaseException as e:
+            self.pipeline.fail(e)
+        finally:
+            if self.outbox is not None:
+                self.outbox.close()
+
+
+class Pipeline:
+    """
+    Runs the source iterator and each of the stages in its own thread
+    so that the stages overlap in time, e.g. decoding of the next frame,
+    inference on the current one and encoding of the previous one.
+    Stages are connected with bounded queues, the last stage is a sink and returns nothing.
+
+    Heavy stages release the GIL (OpenCV, TFLite invoke, pipe writes)
+    so throughput is limited by the slowest stage instead of the sum of all of them.
+    """
+    def __init__(self, source, stages, queue_size: int = 2, overflow: str = OVERFLOW_BLOCK):
+        if not stages:
+            raise Exception('Pipeline must have at least one stage')
+        self.queues = [FrameQueue(queue_size, overflow) for _ in stages]
+        self.workers = [_Worker(self, 'source', None, source, self.queues[0])]
+        for i, (name, fn) in enumerate(stages):
+            outbox = self.queues[i+1] if i+1 < len(stages) else None
+            self.workers.append(_Worker(self, name, fn, self.queues[i], outbox))
+        self.aborted = False
+        self.error = None
+        self.lock = threading.Lock()
+
+    def fail(self, error):
+        with self.lock:
+            if self.error is None:
+                self.error = error
+        self.abort()
+
+    def abort(self):
+        self.aborted = True
+        for q in self.queues:
+            q.abort()
+
+    def run(self):
+        for w in self.workers:
+            w.start()
+        try:
+            for w in self.workers:
+                # Join with timeout to keep the main thread responsive to Ctrl+C
+                while w.is_alive():
+                    w.join(0.5)
+        except KeyboardInterrupt:
+            self.abort()
+            raise
+        if self.error:
+            raise self.error
+
+    @property
+    def dropped(self):
+        return sum(q.dropped for q in self.queues)
+
+    def print_stats(self):
+        counts = ', '.join(f'{w.name}: {w.processed}' for w in self.workers)
+        drops = ', '.join(f'{self.workers[i+1].name}: {q.dropped}' for i, q in enumerate(self.queues))
+        print(f'Processed frames: {counts}')
+        print(f'Dropped frames before stage: {drops}')
@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+
+import metrics
+from detections import Detections
+
+
+_CLASS_COLORS = [
+    (0, 255, 0), (199, 21, 133), (0, 100, 0), (255, 0, 0 ),
+    (154, 205, 50), (123, 104, 238), (255, 160, 122),
+    (32, 178, 170), (216, 191, 216), (255, 255, 0),
+    (210, 105, 30), (175, 238, 238), (135, 206, 250),
+    (220, 220, 220), (255, 248, 220), (100, 149, 237),
+]
+_FONT_FACE = cv2.FONT_HERSHEY_SIMPLEX
+_FONT_SCALE = 0.75
+_FONT_WEIGHT = 1
+
+
+class DetectionRenderer:
+    """
+    Draws detections over frames.
+
+    Label text is rendered once per class at startup into a sprite (class color background
+    with black text) which is then copied into frames with array slicing, that's much cheaper
+    than rendering Hershey text for every box. Box outlines are drawn with one call per class.
+    """
+    def __init__(self, labels: list):
+        self.labelmap = {}
+        for classe, name in enumerate(labels):
+            text_size, baseline = cv2.getTextSize(name, _FONT_FACE, _FONT_SCALE, _FONT_WEIGHT)
+            txt_w, txt_h = text_size
+            color = _CLASS_COLORS[classe % len(_CLASS_COLORS)]
+            sprite = np.empty((txt_h + baseline + 1, txt_w + 1, 3), dtype=np.uint8)
+            sprite[:] = color
+            cv2.putText(sprite, name, (0, txt_h), _FONT_FACE, _FONT_SCALE, (0, 0, 0), _FONT_WEIGHT)
+            self.labelmap[classe] = {
+                'name': name,
+                'txt_w': txt_w,
+                'txt_h': txt_h,
+                'baseline': baseline,
+                'color': color,
+                'sprite': sprite,
+            }
+
+    @metrics.timed('draw')
+    def draw(self, img, det: Detections):
+        if not len(det):
+            return
+
+        # Box outlines, all boxes of a class at once
+        x1, y1, x2, y2 = det.boxes.T
+        corners = np.stack([x1, y1, x2, y1, x2, y2, x1, y2], axis=1).reshape(-1, 4, 2)
+        for classe in np.unique(det.classes).tolist():
+            polys = list(corners[det.classes == classe])
+            cv2.polylines(img, polys, True, self.labelmap[classe]['color'], 2)
+
+        # Labels, sprites are clipped at frame edges
+        img_h, img_w = img.shape[:2]
+        for x, y, classe in zip(x1.tolist(), y1.tolist(), det.classes.tolist()):
+            label = self.labelmap[classe]
+            sprite = label['sprite']
+            top = y - label['txt_h']
+            sx1, sy1 = max(0, -x), max(0, -top)
+            sx2 = min(sprite.shape[1], img_w - x)
+            sy2 = min(sprite.shape[0], img_h - top)
+            if sx1 >= sx2 or sy1 >= sy2:
+                continue
+            img[top+sy1:top+sy2, x+sx1:x+sx2] = sprite[sy1:sy2, sx1:sx2]
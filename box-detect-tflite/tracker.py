@@ -0,0 +1,191 @@
+import time
+import cv2
+import numpy as np
+
+from detections import Detections, iou_matrix
+
+
+MOTION_VELOCITY = 'velocity'
+MOTION_FLOW = 'flow'
+MOTION_MODELS = (MOTION_VELOCITY, MOTION_FLOW)
+
+# Frames are downscaled to this width for optical flow
+_FLOW_WIDTH = 320
+# Points per box side sampled for optical flow
+_FLOW_GRID = 3
+
+
+class BoxTracker:
+    """
+    Carries detection boxes forward between detector runs.
+
+    On keyframes tracks are associated with fresh detections of the same class by IoU.
+    On other frames boxes are moved either with the velocity estimated between keyframes
+    or by the median optical flow of a few points inside each box.
+    Tracks missed by the detector are kept for `max_misses` keyframes to avoid flicker, with lower confidence.
+    Track confidence drops only on tracking failures, when optical flow loses points of a box,
+    `lost` tells when it is time to run the detector again.
+    """
+    def __init__(self, motion: str = MOTION_VELOCITY, iou_threshold: float = 0.3,
+                 min_confidence: float = 0.5, max_misses: int = 1):
+        if motion not in MOTION_MODELS:
+            raise Exception(f'Unsupported motion model {motion}')
+        self.motion = motion
+        self.iou_threshold = iou_threshold
+        self.min_confidence = min_confidence
+        self.max_misses = max_misses
+
+        self.boxes = np.zeros((0, 4), dtype=np.float32)
+        self.velocity = np.zeros((0, 4), dtype=np.float32)
+        self.classes = np.zeros(0, dtype=np.int32)
+        self.scores = np.zeros(0, dtype=np.float32)
+        self.confidence = np.zeros(0, dtype=np.float32)
+        self.misses = np.zeros(0, dtype=np.int32)
+        self.detected_boxes = self.boxes # boxes at the last keyframe
+        self.frames_since_update = 0
+
+        self.prev_gray = None
+        self.flow_scale = 1.0
+
+    @property
+    def lost(self) -> bool:
+        return bool(len(self.confidence)) and bool(self.confidence.min() < self.min_confidence)
+
+    def result(self) -> Detections:
+        return Detections(self.boxes.astype(np.int32), self.classes.copy(), self.scores.copy())
+
+    def update(self, det: Detections, frame=None) -> Detections:
+        """
+        Associates tracks with the detections made on a keyframe.
+        """
+        boxes = det.boxes.astype(np.float32)
+        n_tracks, n_det = len(self.boxes), len(det)
+        matched_tracks = np.full(n_det, -1)
+        if n_tracks and n_det:
+            iou = iou_matrix(self.boxes, boxes)
+            iou[self.classes[:, None] != det.classes[None, :]] = 0
+            # Greedy association, the best overlapping pair first
+            while True:
+                t, d = np.unravel_index(np.argmax(iou), iou.shape)
+                if iou[t, d] < self.iou_threshold:
+                    break
+                matched_tracks[d] = t
+                iou[t, :] = 0
+                iou[:, d] = 0
+
+        # Velocity per frame since the previous keyframe, smoothed with the previous estimate
+        frames = max(self.frames_since_update, 1)
+        velocity = np.zeros((n_det, 4), dtype=np.float32)
+        matched = matched_tracks >= 0
+        if matched.any():
+            t = matched_tracks[matched]
+            measured = (boxes[matched] - self.detected_boxes[t]) / frames
+            velocity[matched] = 0.5 * measured + 0.5 * self.velocity[t]
+
+        # Keep unmatched tracks for a few keyframes, the detector may just have missed them
+        missed = np.setdiff1d(np.arange(n_tracks), matched_tracks[matched])
+        missed = missed[self.misses[missed] < self.max_misses]
+
+        self.boxes = np.concatenate([boxes, self.boxes[missed]])
+        self.velocity = np.concatenate([velocity, self.velocity[missed]])
+        self.classes = np.concatenate([det.classes, self.classes[missed]])
+        self.scores = np.concatenate([det.scores, self.scores[missed]])
+        self.misses = np.concatenate([np.zeros(n_det, dtype=np.int32), self.misses[missed] + 1])
+        # Detected tracks are fully confident, the less the more times the detector has missed a track
+        self.confidence = (1.0 - self.misses / (self.max_misses + 1.0)).astype(np.float32)
+        self.detected_boxes = self.boxes.copy()
+        self.frames_since_update = 0
+
+        if self.motion == MOTION_FLOW and frame is not None:
+            self.prev_gray = self._gray(frame)
+        return self.result()
+
+    def predict(self, frame=None) -> Detections:
+        """
+        Moves tracks to the next frame without running the detector.
+        """
+        self.frames_since_update += 1
+        if self.motion == MOTION_FLOW and frame is not None:
+            self._move_by_flow(frame)
+        else:
+            self.boxes += self.velocity
+        return self.result()
+
+    def _gray(self, frame):
+        h, w = frame.shape[:2]
+        self.flow_scale = min(1.0, _FLOW_WIDTH / w)
+        if self.flow_scale < 1.0:
+            frame = cv2.resize(frame, (round(w * self.flow_scale), round(h * self.flow_scale)), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+    def _move_by_flow(self, frame):
+        gray = self._gray(frame)
+        prev, self.prev_gray = self.prev_gray, gray
+        if prev is None or prev.shape != gray.shape or not len(self.boxes):
+            return
+
+        # Regular grid of points inside each box, away from its edges
+        steps = (np.arange(_FLOW_GRID, dtype=np.float32) + 1) / (_FLOW_GRID + 1)
+        gx, gy = np.meshgrid(steps, steps)
+        boxes = self.boxes * self.flow_scale
+        xs = boxes[:, None, 0] + (boxes[:, None, 2] - boxes[:, None, 0]) * gx.ravel()
+        ys = boxes[:, None, 1] + (boxes[:, None, 3] - boxes[:, None, 1]) * gy.ravel()
+        points = np.stack([xs, ys], axis=-1).reshape(-1, 1, 2).astype(np.float32)
+
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(prev, gray, points, None, winSize=(15, 15), maxLevel=2)
+        shift = (moved - points).reshape(len(boxes), -1, 2) / self.flow_scale
+        ok = status.reshape(len(boxes), -1).astype(bool)
+        for i in range(len(boxes)):
+            if ok[i].any():
+                dx, dy = np.median(shift[i][ok[i]], axis=0)
+                self.boxes[i] += (dx, dy, dx, dy)
+        # Boxes whose points got lost can't be trusted for long
+        self.confidence *= ok.mean(axis=1)
+
+
+class TrackedDetector:
+    """
+    Runs the wrapped detector only on keyframes and tracks boxes in between.
+
+    A keyframe is every `detect_every` frame, or, with `latency_budget` (seconds per frame),
+    a frame when the detection time spread over the frames since the last keyframe fits the budget.
+    The detector is also run as soon as the tracks lose confidence.
+    """
+    def __init__(self, detector, detect_every: int = 0, latency_budget: float = 0, motion: str = MOTION_VELOCITY):
+        if not detect_every and not latency_budget:
+            raise Exception('Either detection interval or latency budget must be set')
+        self.detector = detector
+        self.labels = detector.labels
+        self.detect_every = detect_every
+        self.latency_budget = latency_budget
+        self.tracker = BoxTracker(motion)
+        self.detect_time = 0.0
+        self.since_keyframe = 0
+        self.frames = 0
+        self.keyframes = 0
+
+    def _is_keyframe(self) -> bool:
+        if not self.keyframes or self.tracker.lost:
+            return True
+        if self.detect_every and self.since_keyframe >= self.detect_every:
+            return True
+        if self.latency_budget and self.since_keyframe * self.latency_budget >= self.detect_time:
+            return True
+        return False
+
+    def detect(self, frame) -> Detections:
+        self.frames += 1
+        self.since_keyframe += 1
+        if not self._is_keyframe():
+            return self.tracker.predict(frame)
+
+        start_time = time.perf_counter()
+        det = self.detector.detect(frame)
+        elapsed = time.perf_counter() - start_time
+        self.detect_time = elapsed if not self.keyframes else 0.8 * self.detect_time + 0.2 * elapsed
+        self.keyframes += 1
+        self.since_keyframe = 0
+        return self.tracker.update(det, frame)
+
+    def print_stats(self):
+        print(f'Frames: {self.frames}, detected: {self.keyframes}, tracked: {self.frames - self.keyframes}')
@@ -0,0 +1,97 @@
+import argparse
+import itertools
+import os
+import time
+import cv2
+import numpy as np
+
+import models
+from detector import ObjectDetector
+
+
+_SAMPLE_IMAGE = '../samples/docbrown.jpg'
+_SAMPLE_VIDEO = '../samples/traffic.ts'
+
+
+def _load_samples(max_frames: int):
+    frames = [cv2.imread(_SAMPLE_IMAGE)]
+    cap = cv2.VideoCapture(_SAMPLE_VIDEO)
+    while len(frames) <= max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    print(f'Loaded {len(frames)} sample frames')
+    return frames
+
+
+def _thread_counts():
+    counts = [1]
+    while counts[-1] * 2 <= os.cpu_count():
+        counts.append(counts[-1] * 2)
+    if counts[-1] != os.cpu_count():
+        counts.append(os.cpu_count())
+    return counts
+
+
+def _measure(detector, frames, warmup: int):
+    for frame in frames[:warmup]:
+        detector.detect(frame)
+    times = []
+    for frame in frames:
+        start_time = time.perf_counter()
+        detector.detect(frame)
+        times.append(time.perf_counter() - start_time)
+    times = np.array(times) * 1000
+    return float(np.median(times)), float(np.percentile(times, 95))
+
+
+def _choose(results, target_ms: float):
+    """
+    Without a target the fastest configuration wins. With a target, the one using the fewest threads
+    among those meeting it, so that more detectors fit on the host, and the fastest of them.
+    """
+    if not target_ms:
+        return min(results, key=lambda r: r['p50_ms'])
+    passed = [r for r in results if r['p95_ms'] <= target_ms]
+    if not passed:
+        return None
+    return min(passed, key=lambda r: (r['threads'], r['p50_ms']))
+
+
+def _main():
+    print('Detector autotuner')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--backend', help='backend to tune, only TFLite ones support model variants', choices=['tflite', 'tf'], default='tflite')
+    parser.add_argument('--target', help='p95 latency target, ms', type=float, default=0)
+    parser.add_argument('--frames', help='number of video frames to benchmark on', type=int, default=50)
+    parser.add_argument('--warmup', help='number of warmup frames for each configuration', type=int, default=5)
+    args = parser.parse_args()
+
+    frames = _load_samples(args.frames)
+    results = []
+    for name, info in models.MODELS.items():
+        if not os.path.exists(info.file):
+            print(f'Skip {name}: {info.file} not found')
+            continue
+        for threads, xnnpack in itertools.product(_thread_counts(), [True, False]):
+            # All settings are explicit, so a previously tuned configuration doesn't interfere
+            detector = ObjectDetector(backend=args.backend, model_file=info.file, num_threads=threads, xnnpack=xnnpack)
+            p50, p95 = _measure(detector, frames, args.warmup)
+            print(f'{name}: threads={threads}, xnnpack={xnnpack}: p50 {p50:.1f} ms, p95 {p95:.1f} ms')
+            results.append({'model_name': name, 'model': info.file, 'threads': threads, 'xnnpack': xnnpack, 'p50_ms': p50, 'p95_ms': p95})
+
+    if not results:
+        raise Exception('No models found, see ../models/ssd_mobilenet_v1/get.sh')
+
+    best = _choose(results, args.target)
+    if best is None:
+        raise Exception(f'No configuration meets the target of {args.target} ms')
+    print(f'Best: {best["model_name"]}, threads={best["threads"]}, xnnpack={best["xnnpack"]}, p50 {best["p50_ms"]:.1f} ms, p95 {best["p95_ms"]:.1f} ms')
+    models.save_tuned({'backend': args.backend, **best})
+
+
+if __name__ == '__main__':
+    _main()
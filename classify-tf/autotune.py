@@ -0,0 +1,66 @@
+import argparse
+import itertools
+import os
+
+import session_config
+from benchmark import load_images, run_isolated
+from main import MODEL_INFO
+
+# Grappler variants to try: default optimizers and no graph optimization at all
+_GRAPPLER_PRESETS = [{}, {'meta_optimizer': 'off'}]
+
+
+def _thread_counts():
+    counts = [0, 1]
+    while counts[-1] * 2 <= os.cpu_count():
+        counts.append(counts[-1] * 2)
+    if counts[-1] != os.cpu_count():
+        counts.append(os.cpu_count())
+    return counts
+
+
+def _main():
+    print('Classification session autotuner')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--models', help='comma separated model names, default are all downloaded ones', default=','.join(MODEL_INFO))
+    parser.add_argument('-b', '--batch-size', help='batch size to tune for', type=int, default=1)
+    parser.add_argument('--inter-threads', help='comma separated inter-op thread counts to try', default='1,2')
+    parser.add_argument('--images', help='directory of sample images', default='../samples/imagenet')
+    parser.add_argument('--warmup', help='number of runs not measured', type=int, default=5)
+    parser.add_argument('--iterations', help='number of measured runs', type=int, default=30)
+    args = parser.parse_args()
+
+    # Has effect only before the first session is created, configs without XLA are not affected
+    session_config.enable_cpu_jit()
+
+    inter_threads = [int(n) for n in args.inter_threads.split(',')]
+    for model_name in args.models.split(','):
+        info = MODEL_INFO[model_name]
+        if not os.path.exists(info['graphFile']):
+            print(f'Skip {model_name}: {info["graphFile"]} not found')
+            continue
+
+        imgs = load_images(args.images, info['imgSize'], args.batch_size)
+        best = None
+        for intra, inter, xla, grappler in itertools.product(_thread_counts(), inter_threads, [False, True], _GRAPPLER_PRESETS):
+            options = {'intra_threads': intra, 'inter_threads': inter, 'xla': xla, 'grappler': grappler}
+            try:
+                r = run_isolated(model_name, imgs, args.batch_size, options, args.warmup, args.iterations)
+            except Exception as e:
+                # E.g. XLA is not available in this TF build
+                print(f'{model_name}, {options}: failed: {e}')
+                continue
+            print(f'{model_name}, {options}: p50 {r["p50_ms"]} ms, p95 {r["p95_ms"]} ms, first run {r["first_run_s"]} s')
+            if best is None or r['p50_ms'] < best['p50_ms']:
+                best = {**options, 'batch_size': args.batch_size, 'p50_ms': r['p50_ms'], 'p95_ms': r['p95_ms']}
+
+        if best is None:
+            print(f'No working configuration for {model_name}')
+            continue
+        print(f'Best for {model_name}: {best}')
+        session_config.save_tuned(model_name, best)
+
+
+if __name__ == '__main__':
+    _main()
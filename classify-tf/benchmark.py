@@ -0,0 +1,212 @@
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+import session_config
+from main import INPUT_TENSOR, MODEL_INFO, load_graph, load_image
+
+
+def _peak_rss_mb():
+    if not resource:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _parse_threads(value: str):
+    """
+    Parses a list of thread settings like "0,1,4:2", each of intra-op threads with optional inter-op threads.
+    """
+    settings = []
+    for item in value.split(','):
+        intra, _, inter = item.partition(':')
+        settings.append((int(intra), int(inter or 0)))
+    return settings
+
+
+def load_images(images_dir: str, img_size: int, count: int):
+    file_names = sorted(os.listdir(images_dir))[:count]
+    return np.stack([load_image(os.path.join(images_dir, fn), img_size) for fn in file_names])
+
+
+def run(model_name: str, imgs, batch_size: int, options: dict, warmup: int, iterations: int, optimized: bool = True):
+    """
+    Measures the model with session `options` which are kwargs of session_config.make_config().
+    With `optimized`, the graph made by optimize.py is measured if it exists.
+    """
+    info = MODEL_INFO[model_name]
+
+    start_time = time.perf_counter()
+    graph = load_graph(info['graphFile'], info['inputLayer'], optimized)
+    load_time = time.perf_counter() - start_time
+
+    input = graph.get_tensor_by_name(INPUT_TENSOR)
+    output = graph.get_operation_by_name('import/' + info['outputLayer']).outputs[0]
+
+    config = session_config.make_config(**options)
+
+    # Images are repeated if there are not enough of them for a batch
+    batch = imgs[np.arange(batch_size) % len(imgs)]
+
+    latencies = []
+    with tf.compat.v1.Session(graph=graph, config=config) as sess:
+        start_time = time.perf_counter()
+        sess.run(output, {input: batch})
+        first_run_time = time.perf_counter() - start_time
+
+        for _ in range(warmup):
+            sess.run(output, {input: batch})
+
+        for _ in range(iterations):
+            start_time = time.perf_counter()
+            sess.run(output, {input: batch})
+            latencies.append(time.perf_counter() - start_time)
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'model': model_name,
+        'batch_size': batch_size,
+        'intra_threads': options.get('intra_threads', 0),
+        'inter_threads': options.get('inter_threads', 0),
+        'xla': options.get('xla', False),
+        'grappler': options.get('grappler', {}),
+        'load_time_s': round(load_time, 3),
+        'first_run_s': round(first_run_time, 3),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 2),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 2),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 2),
+        'images_per_sec': round(batch_size * len(latencies) / (latencies.sum() / 1000), 2),
+    }
+
+
+def _run_with_rss(*args):
+    r = run(*args)
+    r['peak_rss_mb'] = _peak_rss_mb()
+    return r
+
+
+def call_isolated(fn, *args):
+    """
+    Calls module level `fn` in a fresh process and returns its result.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(1, mp_context=ctx) as executor:
+        return executor.submit(fn, *args).result()
+
+
+def run_isolated(*args):
+    """
+    Runs run() in a fresh process, so TF thread pools, which are sized once per process by the first session,
+    follow the session options, and the peak RSS of the process is of this configuration only.
+    """
+    return call_isolated(_run_with_rss, *args)
+
+
+def _key(result):
+    return (result['model'], result['batch_size'], result['intra_threads'], result['inter_threads'],
+        result.get('xla', False), json.dumps(result.get('grappler', {}), sort_keys=True))
+
+
+def _compare(baseline, current, tolerance: float):
+    """
+    Prints changes against the baseline, returns the number of regressions beyond `tolerance` percents.
+    """
+    base = {_key(r): r for r in baseline['results']}
+    regressions = 0
+    for r in current['results']:
+        b = base.get(_key(r))
+        if not b:
+            continue
+        # Higher is worse for latencies, lower is worse for throughput
+        worse = []
+        for name, sign in [('p50_ms', 1), ('p95_ms', 1), ('p99_ms', 1), ('images_per_sec', -1)]:
+            change = 100.0 * (r[name] - b[name]) / b[name] if b[name] else 0.0
+            if change * sign > tolerance:
+                worse.append(f'{name} {change:+.1f}%')
+        regressions += bool(worse)
+        status = 'REGRESSION: ' + ', '.join(worse) if worse else 'ok'
+        print('{}, batch {}, threads {}:{}, xla {}, grappler {}: {}'.format(*_key(r), status))
+    return regressions
+
+
+def _main():
+    print('Classification benchmark')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--models', help='comma separated model names, default are all downloaded ones', default=','.join(MODEL_INFO))
+    parser.add_argument('-b', '--batch-sizes', help='comma separated batch sizes', default='1,8')
+    parser.add_argument('-t', '--threads', help='comma separated intra-op threads with optional inter-op ones, e.g. "0,1,4:2", 0 means TF default', default='0')
+    parser.add_argument('--xla', help='enable global XLA JIT compilation', action='store_true')
+    parser.add_argument('--grappler', help='Grappler optimizer options, e.g. "constant_folding=off,remapping=on"')
+    parser.add_argument('--raw', help='measure source graphs even if there are optimized ones, see optimize.py', action='store_true')
+    parser.add_argument('--images', help='directory of sample images', default='../samples/imagenet')
+    parser.add_argument('--warmup', help='number of runs not measured', type=int, default=5)
+    parser.add_argument('--iterations', help='number of measured runs', type=int, default=50)
+    parser.add_argument('-o', '--output', help='JSON file to save results to')
+    parser.add_argument('--baseline', help='JSON file of previous results to compare with')
+    parser.add_argument('--tolerance', help='change in percents considered a regression', type=float, default=10)
+    parser.add_argument('--compare', help='only compare two saved results: baseline and current', nargs=2)
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        sys.exit(1 if _compare(baseline, current, args.tolerance) else 0)
+
+    grappler = session_config.parse_grappler(args.grappler)
+    if args.xla:
+        session_config.enable_cpu_jit()
+
+    report = {
+        'env': {
+            'tensorflow': tf.__version__,
+            'numpy': np.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': [],
+    }
+    for model_name in args.models.split(','):
+        info = MODEL_INFO[model_name]
+        if not os.path.exists(info['graphFile']):
+            print(f'Skip {model_name}: {info["graphFile"]} not found')
+            continue
+        batch_sizes = [int(size) for size in args.batch_sizes.split(',')]
+        imgs = load_images(args.images, info['imgSize'], max(batch_sizes))
+        for batch_size in batch_sizes:
+            for intra_threads, inter_threads in _parse_threads(args.threads):
+                options = {'intra_threads': intra_threads, 'inter_threads': inter_threads, 'xla': args.xla, 'grappler': grappler}
+                r = run_isolated(model_name, imgs, batch_size, options, args.warmup, args.iterations, not args.raw)
+                print('{}, batch {}, threads {}:{}: p50 {} ms, p95 {} ms, p99 {} ms, {} images/s, load {} s'.format(
+                    model_name, batch_size, intra_threads, inter_threads,
+                    r['p50_ms'], r['p95_ms'], r['p99_ms'], r['images_per_sec'], r['load_time_s']))
+                report['results'].append(r)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results saved to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        sys.exit(1 if _compare(baseline, report, args.tolerance) else 0)
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,57 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+def _classify(url: str, file_name: str, model: str, top: int):
+    query = {'top': top}
+    if model:
+        query['model'] = model
+    with open(file_name, 'rb') as f:
+        data = f.read()
+    request = urllib.request.Request(f'{url}/classify?{urllib.parse.urlencode(query)}', data=data, method='POST')
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        # Errors of classification are JSON, others like 404 are HTML pages of the server
+        try:
+            return json.load(e)
+        except ValueError:
+            return {'error': f'HTTP {e.code} {e.reason}'}
+    except urllib.error.URLError as e:
+        return {'error': f'Server is not available: {e.reason}'}
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Classifies images using server.py')
+    parser.add_argument('input', help='input image or directory')
+    parser.add_argument('-m', '--model', help='model name, default is the first one loaded by the server')
+    parser.add_argument('-k', '--top', help='number of labels to return', type=int, default=5)
+    parser.add_argument('-u', '--url', help='server address', default='http://127.0.0.1:8500')
+    parser.add_argument('-j', '--jobs', help='number of concurrent requests', type=int, default=1)
+    args = parser.parse_args()
+
+    if os.path.isdir(args.input):
+        file_names = [os.path.join(args.input, fn) for fn in sorted(os.listdir(args.input))]
+    else:
+        file_names = [args.input]
+
+    with concurrent.futures.ThreadPoolExecutor(args.jobs) as executor:
+        results = executor.map(lambda fn: _classify(args.url, fn, args.model, args.top), file_names)
+        for file_name, result in zip(file_names, results):
+            print('\nImage: {}'.format(file_name))
+            if 'error' in result:
+                print('Error:', result['error'])
+                continue
+            print('Labels:')
+            for item in result['labels']:
+                print(item['label'], item['score'])
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import numpy as np
+
+# This module is also used by ../classify-tf1 which runs on Python 2, keep it compatible
+
+
+class InputCache(object):
+    """
+    Disk cache of preprocessed model inputs stored as `.npy` files.
+
+    Entries are keyed by the image path, its modification time and size, the model input size
+    and the preprocessing variant, so changed images or preprocessing get new entries.
+    Cached inputs are memory-mapped, they are not copied into memory until used.
+    When the cache grows over `max_bytes`, the least recently used entries are removed.
+    """
+    def __init__(self, cache_dir, img_size, variant, max_bytes):
+        print('Init InputCache: {}'.format(cache_dir))
+        self.cache_dir = cache_dir
+        self.img_size = img_size
+        self.variant = variant
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.total_bytes = sum(size for _, _, size in self._entries())
+
+    def _entries(self):
+        entries = [] # (path, access time, size)[]
+        for fn in os.listdir(self.cache_dir):
+            if fn.endswith('.npy'):
+                path = os.path.join(self.cache_dir, fn)
+                st = os.stat(path)
+                entries.append((path, st.st_mtime, st.st_size))
+        return entries
+
+    def _path(self, file_name):
+        st = os.stat(file_name)
+        key = '{}|{}|{}|{}|{}'.format(os.path.abspath(file_name), st.st_mtime, st.st_size, self.img_size, self.variant)
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npy')
+
+    def lookup(self, file_name):
+        """
+        Returns the cached memory-mapped input or None.
+        """
+        path = self._path(file_name)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Modification time of the entry tracks its last use for eviction
+        os.utime(path, None)
+        return np.load(path, mmap_mode='r')
+
+    def put(self, file_name, data):
+        """
+        Stores the input and returns its memory-mapped copy.
+        """
+        path = self._path(file_name)
+        # Write to a temporary file first, so an interrupted run doesn't leave a broken entry
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, data)
+        os.rename(tmp_path, path)
+        self.total_bytes += os.path.getsize(path)
+        if self.total_bytes > self.max_bytes:
+            self._evict()
+        return np.load(path, mmap_mode='r')
+
+    def _evict(self):
+        # Free some more space than needed, so eviction doesn't run on every new entry
+        target = self.max_bytes * 0.9
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        self.total_bytes = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self.total_bytes <= target:
+                break
+            os.remove(path)
+            self.total_bytes -= size
+            self.evicted += 1
+
+    def print_stats(self):
+        total = self.hits + self.misses
+        hit_rate = 100.0 * self.hits / total if total else 0.0
+        print('Input cache: hits {}, misses {} ({:.1f}% hit rate), evicted {}, size {:.1f} MB of {:.1f} MB'.format(
+            self.hits, self.misses, hit_rate, self.evicted, self.total_bytes / 1048576.0, self.max_bytes / 1048576.0))
@@ -1,10 +1,17 @@
 import argparse
 import os
+import queue
+import threading
 import time
 import numpy as np
 import cv2
 import tensorflow as tf
 
+import model_cache
+import session_config
+from input_cache import InputCache
+from sharding import ShardedClassifier
+
 MODEL_INFO = {
     'mobilenet_v1': {
         'imgSize': 160,
@@ -34,39 +41,178 @@ OUTPUT_LAYER = MODEL_INFO[MODEL_NAME]['outputLayer']
 
 RESULT_COUNT = 5
 
-def _load_image(file_name: str):
-    img = cv2.imread(file_name)
-    img = cv2.resize(img, (IMG_SIZE, IMG_SIZE), cv2.INTER_AREA)
-    img = img.reshape([1, IMG_SIZE, IMG_SIZE, 3])
-    img = img.astype(float)
-    # Normalize
-    img = img / 255.0
-    img = img - 0.5
-    img = img * 2
-    # Subtract mean
-    img = img - np.mean(img)
+# Changes when load_image does, so cached images of the old preprocessing aren't used
+CACHE_VARIANT = 'cv2-area-uint8-v3'
+
+# Graphs are fed with uint8 images through this placeholder, see load_graph
+INPUT_TENSOR = 'input_uint8:0'
+
+def load_image(file_name: str, img_size: int = IMG_SIZE):
+    return preprocess_image(cv2.imread(file_name), img_size)
+
+
+def preprocess_image(img, img_size: int = IMG_SIZE):
+    # Images stay uint8, normalization is done by the graph
+    return cv2.resize(img, (img_size, img_size), interpolation=cv2.INTER_AREA)
+
+
+def _load_cached(file_name: str, cache):
+    if cache is None:
+        return load_image(file_name)
+    img = cache.lookup(file_name)
+    if img is None:
+        img = cache.put(file_name, load_image(file_name))
     return img
 
 
-def _load_labels():
-    with open(LABELS_FILE) as f:
+def _prefetch_images(files, cache, prefetch: int):
+    """
+    Yields {name, data} of (name, file name) pairs in order, the images are decoded
+    by a background thread at most `prefetch` images ahead of the consumer.
+    """
+    imgs = queue.Queue(prefetch)
+
+    def produce():
+        try:
+            for name, file_name in files:
+                imgs.put({'name': name, 'data': _load_cached(file_name, cache)})
+            imgs.put(None)
+        except Exception as e:
+            imgs.put(e)
+
+    threading.Thread(target=produce, name='prefetch', daemon=True).start()
+    while True:
+        img = imgs.get()
+        if img is None:
+            return
+        if isinstance(img, Exception):
+            raise img
+        yield img
+
+
+def _make_batches(imgs, batch_size: int):
+    """
+    Yields images stacked into NHWC batches {names, data}, the last batch can be smaller.
+    """
+    def stack(chunk):
+        return {
+            'names': [img['name'] for img in chunk],
+            # A single image is fed as a view, so memory-mapped cached images aren't copied
+            'data': chunk[0]['data'][np.newaxis] if len(chunk) == 1 else np.stack([img['data'] for img in chunk]),
+        }
+
+    chunk = []
+    for img in imgs:
+        chunk.append(img)
+        if len(chunk) == batch_size:
+            yield stack(chunk)
+            chunk = []
+    if chunk:
+        yield stack(chunk)
+
+
+def top_k(results, k: int):
+    """
+    Returns indices of `k` best classes for each row of [batch, classes] results, best first.
+    """
+    k = min(k, results.shape[1])
+    # argpartition finds top k in linear time, only those k get sorted then
+    top = np.argpartition(-results, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(results, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def load_labels(labels_file: str = LABELS_FILE):
+    with open(labels_file) as f:
         return [l.rstrip() for l in f.readlines()]
     #lines = tf.io.gfile.GFile(LABELS_FILE).readlines()
     #return [l.rstrip() for l in lines]
 
 
-def _load_graph():
+def load_graph(graph_file: str = GRAPH_FILE, input_layer: str = INPUT_LAYER, optimized: bool = True):
+    """
+    Imports the frozen graph with its float input fed by a prefix taking uint8 images,
+    the prefix scales pixels to [-1, 1] and subtracts the mean of each image.
+    The graph optimized by optimize.py is used instead of the source one if it exists.
+    """
+    if optimized:
+        optimized_file = model_cache.find_optimized(graph_file)
+        if optimized_file:
+            print(f'Use optimized graph {optimized_file}')
+            graph_file = optimized_file
+
     graph_def = tf.compat.v1.GraphDef()
-    with open(GRAPH_FILE, "rb") as f:
+    with open(graph_file, "rb") as f:
         graph_def.ParseFromString(f.read())
 
     graph = tf.compat.v1.Graph()
     with graph.as_default():
-        tf.import_graph_def(graph_def)
+        input_uint8 = tf.compat.v1.placeholder(tf.uint8, [None, None, None, 3], name=INPUT_TENSOR.split(':')[0])
+        img = tf.cast(input_uint8, tf.float32) * (2.0 / 255.0) - 1.0
+        img = img - tf.reduce_mean(img, axis=[1, 2, 3], keepdims=True)
+        tf.import_graph_def(graph_def, input_map={input_layer: img})
 
     return graph
 
 
+def _session_options(args):
+    """
+    Session options given on the command line, others are taken from autotune.py results.
+    It must be called before TF initializes devices, so XLA JIT can be enabled for CPU.
+    """
+    options = session_config.load_tuned(MODEL_NAME)
+    if args.intra_threads is not None:
+        options['intra_threads'] = args.intra_threads
+    if args.inter_threads is not None:
+        options['inter_threads'] = args.inter_threads
+    if args.xla:
+        options['xla'] = True
+    if args.grappler:
+        options['grappler'] = session_config.parse_grappler(args.grappler)
+    if options.get('xla'):
+        session_config.enable_cpu_jit()
+    return options
+
+
+# Session of a sharded worker process, see sharding.py
+_worker = {}
+
+
+def _init_worker(intra_threads: int, inter_threads: int):
+    graph = load_graph()
+    config = tf.compat.v1.ConfigProto()
+    config.intra_op_parallelism_threads = intra_threads
+    config.inter_op_parallelism_threads = inter_threads
+    _worker['sess'] = tf.compat.v1.Session(graph=graph, config=config)
+    _worker['input'] = graph.get_tensor_by_name(INPUT_TENSOR)
+    _worker['output'] = graph.get_operation_by_name('import/' + OUTPUT_LAYER).outputs[0]
+    _worker['labels'] = load_labels()
+
+
+def _classify_chunk(file_names):
+    """
+    Classifies files as one batch, returns a record per file, images failed to read get an error.
+    """
+    records = []
+    imgs = []
+    for fn in file_names:
+        img = cv2.imread(fn)
+        if img is None:
+            records.append({'file': fn, 'error': 'Failed to read image'})
+            continue
+        records.append({'file': fn})
+        imgs.append(preprocess_image(img))
+    if not imgs:
+        return records
+
+    results = _worker['sess'].run(_worker['output'], {_worker['input']: np.stack(imgs)})
+    labels = _worker['labels']
+    ok_records = [r for r in records if 'error' not in r]
+    for record, scores, top in zip(ok_records, results, top_k(results, RESULT_COUNT)):
+        record['labels'] = [(labels[i], float(scores[i])) for i in top]
+    return records
+
+
 def _main():
     print('-------------------------------------------')
     print('Sample image classification')
@@ -74,22 +220,55 @@ def _main():
     parser = argparse.ArgumentParser()
     parser.add_argument('input', help='input image')
     parser.add_argument('-l', '--loops', help='', type=int, default=1)
+    parser.add_argument('-b', '--batch-size', help='number of images per inference, comma separated list to compare several', default='1')
+    parser.add_argument('--cache', help='directory to cache preprocessed images in')
+    parser.add_argument('--cache-size', help='max size of the cache, MB', type=int, default=1024)
+    parser.add_argument('--intra-threads', help='threads to run an op, 0 means TF default, default is tuned or 0', type=int)
+    parser.add_argument('--inter-threads', help='threads to run independent ops, 0 means TF default, default is tuned or 0', type=int)
+    parser.add_argument('--xla', help='enable global XLA JIT compilation', action='store_true')
+    parser.add_argument('--grappler', help='Grappler optimizer options, e.g. "constant_folding=off,remapping=on", "meta_optimizer=off" disables it')
+    parser.add_argument('--prefetch', help='max number of images decoded ahead of classification', type=int, default=16)
+    parser.add_argument('-w', '--workers', help='classify a directory in this many processes, sharing CPU cores between them', type=int, default=0)
+    parser.add_argument('-o', '--output', help='JSONL or CSV file for results of sharded classification')
+    parser.add_argument('--chunk-size', help='number of images given to a worker at once', type=int, default=64)
+    parser.add_argument('--resume', help='continue sharded classification from its checkpoint', action='store_true')
     args = parser.parse_args()
+    args.batch_size = [int(size) for size in args.batch_size.split(',')]
+
+    # Before anything initializes TF devices, XLA flags are read then
+    options = _session_options(args)
 
     if not args.input:
         raise Exception('Input source is not specified')
 
-        # Load images
-    imgs = [] # {name, data}[]
+    if args.workers:
+        if not args.output:
+            raise Exception('Output file is required for sharded classification')
+        # Sorted, so the order is the same when resuming
+        file_names = [os.path.join(args.input, fn) for fn in sorted(os.listdir(args.input))]
+        classifier = ShardedClassifier(_init_worker, _classify_chunk, args.workers, args.chunk_size, RESULT_COUNT)
+        classifier.run(file_names, args.output, args.resume)
+        return
+
+    cache = None
+    if args.cache:
+        cache = InputCache(args.cache, IMG_SIZE, CACHE_VARIANT, args.cache_size * 1024 * 1024)
+
+    # Load images
     if os.path.isdir(args.input):
-        for fn in os.listdir(args.input):
-            img = _load_image(os.path.join(args.input, fn))
-            imgs.append({'name': fn, 'data': img})
+        files = [(fn, os.path.join(args.input, fn)) for fn in os.listdir(args.input)]
     else:
-        img = _load_image(args.input)
-        imgs.append({'name': args.input, 'data': img})
+        files = [(args.input, args.input)]
 
-    labels = _load_labels()
+    # Images are needed for each loop in benchmark mode, otherwise they are classified as they are decoded,
+    # so memory depends only on the prefetch depth
+    imgs = None # {name, data}[]
+    if args.loops != 1:
+        imgs = list(_prefetch_images(files, cache, args.prefetch))
+        if cache:
+            cache.print_stats()
+
+    labels = load_labels()
 
     # https://www.tensorflow.org/guide/gpu
     gpus = tf.config.list_physical_devices('GPU')
@@ -109,46 +288,68 @@ def _main():
 
 
     # Graph is a combination of model definition and trained weights
-    graph = _load_graph()
+    graph = load_graph()
 
-    input = graph.get_operation_by_name('import/' + INPUT_LAYER).outputs[0]
+    input = graph.get_tensor_by_name(INPUT_TENSOR)
     output = graph.get_operation_by_name('import/' + OUTPUT_LAYER).outputs[0]
 
-    config = tf.compat.v1.ConfigProto()
-    config.gpu_options.allow_growth = True
+    print('Session options: {}'.format(options or 'default'))
+    config = session_config.make_config(**options)
     config.gpu_options.per_process_gpu_memory_fraction = 0.33
 
-    loops = 0
-    total_images = 0
-    total_elapsed = 0.0
+    summary = []
     with tf.compat.v1.Session(graph=graph, config=config) as sess:
-        while True:
-            start_time = time.time()
-            for img in imgs:
-                results = sess.run(output, {input: img['data']})
-
-                # Print most relevant results if not in looped moode
-                if args.loops == 1:
-                    results = np.squeeze(results)
-                    print('\nImage: {}\nLabels:'.format(img['name']))
-                    for i in results.argsort()[-RESULT_COUNT:][::-1]:
-                        print(labels[i], results[i])
-
-            loops += 1
-
-            # The first loop is warming up, don't measure
-            if loops > 1:
-                elapsed = time.time() - start_time
-                total_images += len(imgs)
-                total_elapsed += elapsed
-                fps = float(len(imgs)) / elapsed
-                avg_fps = float(total_images) / total_elapsed
-                print('Loop: {}, FPS: {:.2f}, Avg FPS: {:.2f}'.format(loops, fps, avg_fps))
-
-            if args.loops == 0:
-                continue
-            if loops == args.loops:
-                break
+        for batch_size in args.batch_size:
+            if imgs is None:
+                batches = _make_batches(_prefetch_images(files, cache, args.prefetch), batch_size)
+            else:
+                batches = list(_make_batches(imgs, batch_size))
+
+            loops = 0
+            total_images = 0
+            total_elapsed = 0.0
+            total_batches = 0
+            while True:
+                start_time = time.time()
+                for batch in batches:
+                    results = sess.run(output, {input: batch['data']})
+
+                    # Print most relevant results if not in looped moode
+                    if args.loops == 1:
+                        for name, scores, top in zip(batch['names'], results, top_k(results, RESULT_COUNT)):
+                            print('\nImage: {}\nLabels:'.format(name))
+                            for i in top:
+                                print(labels[i], scores[i])
+
+                loops += 1
+
+                # The first loop is warming up, don't measure
+                if loops > 1:
+                    elapsed = time.time() - start_time
+                    total_images += len(imgs)
+                    total_elapsed += elapsed
+                    total_batches += len(batches)
+                    fps = float(len(imgs)) / elapsed
+                    avg_fps = float(total_images) / total_elapsed
+                    batch_ms = 1000.0 * total_elapsed / total_batches
+                    print('Batch size: {}, Loop: {}, FPS: {:.2f}, Avg FPS: {:.2f}, Avg batch latency: {:.1f} ms'.format(
+                        batch_size, loops, fps, avg_fps, batch_ms))
+
+                if args.loops == 0:
+                    continue
+                if loops == args.loops:
+                    break
+
+            if total_batches:
+                summary.append((batch_size, float(total_images) / total_elapsed, 1000.0 * total_elapsed / total_batches))
+
+    if cache and imgs is None:
+        cache.print_stats()
+
+    if len(summary) > 1:
+        print('-------------------------------------------')
+        for batch_size, avg_fps, batch_ms in summary:
+            print('Batch size: {:4d}, Avg FPS: {:8.2f}, Avg batch latency: {:8.1f} ms'.format(batch_size, avg_fps, batch_ms))
 
 
 if __name__ == '__main__':
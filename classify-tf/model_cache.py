@@ -0,0 +1,70 @@
+import hashlib
+import json
+import os
+
+# Optimized models made by optimize.py, load_graph uses them instead of source graphs
+CACHE_DIR = '../models/optimized'
+
+# Changes when optimize.py optimizes graphs differently, so artifacts of older optimizations aren't used
+VARIANT = 'v1'
+
+# Source file hashes by path, modification time and size, so they are not recomputed on each start
+_INDEX_FILE = 'index.json'
+
+
+def _write_atomic(file_name: str, data: bytes):
+    tmp_file = file_name + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_file, file_name)
+
+
+def source_hash(graph_file: str) -> str:
+    """
+    Returns sha256 of the file contents, it's computed once per file version.
+    """
+    index_file = os.path.join(CACHE_DIR, _INDEX_FILE)
+    index = {}
+    if os.path.exists(index_file):
+        with open(index_file) as f:
+            index = json.load(f)
+
+    st = os.stat(graph_file)
+    key = os.path.abspath(graph_file)
+    entry = index.get(key)
+    if entry and entry['mtime'] == st.st_mtime and entry['size'] == st.st_size:
+        return entry['sha256']
+
+    sha = hashlib.sha256()
+    with open(graph_file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    index[key] = {'mtime': st.st_mtime, 'size': st.st_size, 'sha256': sha.hexdigest()}
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    _write_atomic(index_file, json.dumps(index, indent=2).encode())
+    return sha.hexdigest()
+
+
+def artifact_file(graph_file: str, ext: str) -> str:
+    """
+    Path of the optimized model of the graph file with extension `.pb` or `.tflite`.
+    """
+    name = os.path.splitext(os.path.basename(graph_file))[0]
+    return os.path.join(CACHE_DIR, f'{name}-{source_hash(graph_file)[:16]}-{VARIANT}{ext}')
+
+
+def find_optimized(graph_file: str):
+    """
+    Returns the optimized graph of the graph file if it's been made, otherwise None.
+    """
+    # Don't hash source graphs if nothing has been optimized at all
+    if not os.path.isdir(CACHE_DIR):
+        return None
+    optimized_file = artifact_file(graph_file, '.pb')
+    return optimized_file if os.path.exists(optimized_file) else None
+
+
+def save_artifact(graph_file: str, ext: str, data: bytes) -> str:
+    optimized_file = artifact_file(graph_file, ext)
+    _write_atomic(optimized_file, data)
+    return optimized_file
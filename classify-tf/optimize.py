@@ -0,0 +1,185 @@
+import argparse
+import os
+import time
+import numpy as np
+import tensorflow as tf
+from tensorflow.core.protobuf import config_pb2, meta_graph_pb2
+from tensorflow.python.grappler import tf_optimizer
+from tensorflow.python.tools import optimize_for_inference_lib
+
+import model_cache
+from benchmark import call_isolated, load_images, run_isolated
+from main import INPUT_TENSOR, MODEL_INFO, load_graph
+
+
+def _fold_constants(graph_def, output_layer: str):
+    graph = tf.compat.v1.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name='')
+    meta_graph = tf.compat.v1.train.export_meta_graph(graph=graph)
+
+    # Grappler keeps only nodes needed for the fetches listed in the train_op collection
+    fetches = meta_graph_pb2.CollectionDef()
+    fetches.node_list.value.append(output_layer)
+    meta_graph.collection_def['train_op'].CopyFrom(fetches)
+
+    # Only device independent optimizers, fusions like remapping are still done by sessions
+    config = config_pb2.ConfigProto()
+    rewrite = config.graph_options.rewrite_options
+    rewrite.optimizers.extend(['constfold', 'arithmetic', 'dependency'])
+    rewrite.min_graph_nodes = -1
+    return tf_optimizer.OptimizeGraph(config, meta_graph)
+
+
+def _optimize_graph_def(graph_def, input_layer: str, output_layer: str):
+    """
+    Strips training-only and unused nodes, folds batch norms into convolutions and folds constants.
+    """
+    graph_def = optimize_for_inference_lib.optimize_for_inference(
+        graph_def, [input_layer], [output_layer], tf.float32.as_datatype_enum)
+    return _fold_constants(graph_def, output_layer)
+
+
+def _optimize_graph(info: dict) -> str:
+    graph_def = tf.compat.v1.GraphDef()
+    with open(info['graphFile'], 'rb') as f:
+        graph_def.ParseFromString(f.read())
+    nodes = len(graph_def.node)
+
+    graph_def = _optimize_graph_def(graph_def, info['inputLayer'], info['outputLayer'])
+    optimized_file = model_cache.save_artifact(info['graphFile'], '.pb', graph_def.SerializeToString())
+    print(f'Optimized graph saved to {optimized_file}, nodes: {nodes} -> {len(graph_def.node)}')
+    return optimized_file
+
+
+def _tflite_ext(quantize: bool) -> str:
+    return '.quant.tflite' if quantize else '.tflite'
+
+
+def _convert_tflite(info: dict, imgs, quantize: bool) -> str:
+    """
+    Converts the optimized graph with its uint8 input prefix, so the TFLite model takes the same images.
+    """
+    graph = load_graph(info['graphFile'], info['inputLayer'])
+    input = graph.get_tensor_by_name(INPUT_TENSOR)
+    output = graph.get_operation_by_name('import/' + info['outputLayer']).outputs[0]
+    # TFLite needs a static input shape, the batch size is changed by the interpreter when needed
+    input.set_shape([1, info['imgSize'], info['imgSize'], 3])
+
+    with tf.compat.v1.Session(graph=graph) as sess:
+        converter = tf.compat.v1.lite.TFLiteConverter.from_session(sess, [input], [output])
+        if quantize:
+            # Weights and activations are quantized, ranges of activations are taken on sample images
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.representative_dataset = lambda: ([img[np.newaxis]] for img in imgs)
+        data = converter.convert()
+
+    tflite_file = model_cache.save_artifact(info['graphFile'], _tflite_ext(quantize), data)
+    print(f'TFLite model saved to {tflite_file}')
+    return tflite_file
+
+
+def _run_tflite(tflite_file: str, imgs, batch_size: int, threads: int, warmup: int, iterations: int):
+    """
+    Measures the TFLite model the same way as benchmark.run does the graph.
+    """
+    start_time = time.perf_counter()
+    interpreter = tf.lite.Interpreter(model_path=tflite_file, num_threads=threads or None)
+    input = interpreter.get_input_details()[0]['index']
+    output = interpreter.get_output_details()[0]['index']
+    batch = imgs[np.arange(batch_size) % len(imgs)]
+    interpreter.resize_tensor_input(input, batch.shape)
+    interpreter.allocate_tensors()
+    load_time = time.perf_counter() - start_time
+
+    def invoke():
+        interpreter.set_tensor(input, batch)
+        interpreter.invoke()
+        return interpreter.get_tensor(output)
+
+    start_time = time.perf_counter()
+    invoke()
+    first_run_time = time.perf_counter() - start_time
+
+    for _ in range(warmup):
+        invoke()
+
+    latencies = []
+    for _ in range(iterations):
+        start_time = time.perf_counter()
+        invoke()
+        latencies.append(time.perf_counter() - start_time)
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'load_time_s': round(load_time, 3),
+        'first_run_s': round(first_run_time, 3),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 2),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 2),
+    }
+
+
+def _print_report(model_name: str, rows: list):
+    print(f'\n{model_name}')
+    print(f'{"model":<10} {"size, MB":>9} {"load, s":>8} {"first run, s":>13} {"startup, s":>11} {"p50, ms":>8} {"p95, ms":>8}')
+    for name, file_name, r in rows:
+        size = os.path.getsize(file_name) / (1 << 20)
+        startup = r['load_time_s'] + r['first_run_s']
+        print(f'{name:<10} {size:>9.1f} {r["load_time_s"]:>8.3f} {r["first_run_s"]:>13.3f} {startup:>11.3f} {r["p50_ms"]:>8.2f} {r["p95_ms"]:>8.2f}')
+
+
+def _main():
+    print('Classification model optimizer')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--models', help='comma separated model names, default are all downloaded ones', default=','.join(MODEL_INFO))
+    parser.add_argument('--tflite', help='also convert optimized graphs to TFLite', action='store_true')
+    parser.add_argument('--quantize', help='quantize TFLite models, implies --tflite', action='store_true')
+    parser.add_argument('--force', help='rebuild optimized models even if they exist', action='store_true')
+    parser.add_argument('--no-report', help="don't measure raw and optimized models", action='store_true')
+    parser.add_argument('-b', '--batch-size', help='batch size to measure', type=int, default=1)
+    parser.add_argument('-t', '--threads', help='intra-op threads for graphs and threads for TFLite, 0 means default', type=int, default=0)
+    parser.add_argument('--images', help='directory of sample images, also used to quantize TFLite models', default='../samples/imagenet')
+    parser.add_argument('--warmup', help='number of runs not measured', type=int, default=5)
+    parser.add_argument('--iterations', help='number of measured runs', type=int, default=50)
+    args = parser.parse_args()
+
+    for model_name in args.models.split(','):
+        info = MODEL_INFO[model_name]
+        if not os.path.exists(info['graphFile']):
+            print(f'Skip {model_name}: {info["graphFile"]} not found')
+            continue
+
+        optimized_file = model_cache.find_optimized(info['graphFile'])
+        if args.force or not optimized_file:
+            optimized_file = _optimize_graph(info)
+        else:
+            print(f'Optimized graph is up to date: {optimized_file}')
+
+        imgs = load_images(args.images, info['imgSize'], max(args.batch_size, 16))
+
+        tflite_file = model_cache.artifact_file(info['graphFile'], _tflite_ext(args.quantize))
+        if args.tflite or args.quantize:
+            if args.force or not os.path.exists(tflite_file):
+                _convert_tflite(info, imgs, args.quantize)
+            else:
+                print(f'TFLite model is up to date: {tflite_file}')
+
+        if args.no_report:
+            continue
+        options = {'intra_threads': args.threads}
+        # Each model is measured in a new process, so its startup includes TF runtime initialization
+        # rather than reusing the one done for the previous model
+        rows = [
+            ('raw', info['graphFile'], run_isolated(model_name, imgs, args.batch_size, options, args.warmup, args.iterations, False)),
+            ('optimized', optimized_file, run_isolated(model_name, imgs, args.batch_size, options, args.warmup, args.iterations, True)),
+        ]
+        for name, quantize in [('tflite', False), ('quantized', True)]:
+            tflite_file = model_cache.artifact_file(info['graphFile'], _tflite_ext(quantize))
+            if os.path.exists(tflite_file):
+                rows.append((name, tflite_file, call_isolated(_run_tflite, tflite_file, imgs, args.batch_size, args.threads, args.warmup, args.iterations)))
+        _print_report(model_name, rows)
+
+
+if __name__ == '__main__':
+    _main()
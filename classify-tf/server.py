@@ -0,0 +1,202 @@
+import argparse
+import concurrent.futures
+import http.server
+import json
+import os
+import queue
+import threading
+import time
+import urllib.parse
+import cv2
+import numpy as np
+import tensorflow as tf
+
+import session_config
+from main import INPUT_TENSOR, MODEL_INFO, RESULT_COUNT, load_graph, load_labels, preprocess_image, top_k
+
+
+class BatchingModel:
+    """
+    Keeps a model loaded and runs requests of concurrent clients in batches.
+
+    A batch is started by the first waiting request and collects others
+    until it gets `max_batch` images or `max_wait` seconds pass.
+    Session options are tuned ones of the model with `threads` replacing its thread counts.
+    """
+    def __init__(self, model_name: str, max_batch: int, max_wait: float, threads: dict):
+        print(f'Init BatchingModel: {model_name}')
+        info = MODEL_INFO[model_name]
+        self.img_size = info['imgSize']
+        self.labels = load_labels(info['labelsFile'])
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+
+        graph = load_graph(info['graphFile'], info['inputLayer'])
+        self.input = graph.get_tensor_by_name(INPUT_TENSOR)
+        self.output = graph.get_operation_by_name('import/' + info['outputLayer']).outputs[0]
+        options = {**session_config.load_tuned(model_name), **threads}
+        self.sess = tf.compat.v1.Session(graph=graph, config=session_config.make_config(**options))
+
+        # The first run is slow, don't make the first client wait for it
+        self.sess.run(self.output, {self.input: np.zeros((1, self.img_size, self.img_size, 3), dtype=np.uint8)})
+
+        self.requests = queue.Queue() # (image, future)
+        self.batches = 0
+        self.images = 0
+        threading.Thread(target=self._work, name=f'batch-{model_name}', daemon=True).start()
+
+    def classify(self, img) -> concurrent.futures.Future:
+        """
+        Queues a preprocessed image, the future gets its results row.
+        """
+        future = concurrent.futures.Future()
+        self.requests.put((img, future))
+        return future
+
+    def _collect(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _work(self):
+        while True:
+            batch = self._collect()
+            try:
+                results = self.sess.run(self.output, {self.input: np.stack([img for img, _ in batch])})
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.images += len(batch)
+            for (_, future), row in zip(batch, results):
+                future.set_result(row)
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'images': self.images,
+            'avg_batch_size': round(self.images / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    # Set by _main
+    models = {}
+    default_model = None
+
+    def _reply(self, code: int, data):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self.send_error(404)
+            return
+        self._reply(200, {name: model.stats() for name, model in self.models.items()})
+
+    def do_POST(self):
+        """
+        POST /classify?model=NAME&top=K with an encoded image in the body.
+        """
+        url = urllib.parse.urlparse(self.path)
+        if url.path != '/classify':
+            self.send_error(404)
+            return
+        params = urllib.parse.parse_qs(url.query)
+        model_name = params.get('model', [self.default_model])[0]
+        model = self.models.get(model_name)
+        if not model:
+            self._reply(400, {'error': f'Unknown model {model_name}, available: {", ".join(self.models)}'})
+            return
+        try:
+            top = int(params.get('top', [RESULT_COUNT])[0])
+        except ValueError:
+            top = 0
+        if top < 1:
+            self._reply(400, {'error': 'Parameter top must be a positive integer'})
+            return
+        length = self.headers.get('Content-Length', '')
+        if not length.isdigit():
+            self._reply(400, {'error': 'Content-Length is required'})
+            return
+
+        data = self.rfile.read(int(length))
+        try:
+            # Raises on empty data instead of returning None
+            img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        except cv2.error:
+            img = None
+        if img is None:
+            self._reply(400, {'error': 'Failed to decode image'})
+            return
+
+        try:
+            # Preprocessing runs in the handler thread, so it's parallel for concurrent clients
+            scores = model.classify(preprocess_image(img, model.img_size)).result()
+        except Exception as e:
+            self._reply(500, {'error': f'Classification failed: {e}'})
+            return
+        top = top_k(scores[np.newaxis], top)[0]
+        self._reply(200, {
+            'model': model_name,
+            'labels': [{'label': model.labels[i], 'score': float(scores[i])} for i in top],
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _main():
+    print('Image classification server')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--models', help='comma separated model names to keep loaded, the first one is default, default are all downloaded ones')
+    parser.add_argument('--host', help='address to listen on', default='127.0.0.1')
+    parser.add_argument('-p', '--port', help='port to listen on', type=int, default=8500)
+    parser.add_argument('--max-batch', help='max number of images in a batch', type=int, default=16)
+    parser.add_argument('--max-wait', help='max time a request waits for others to join its batch, ms', type=float, default=5)
+    args = parser.parse_args()
+
+    if args.models:
+        model_names = args.models.split(',')
+    else:
+        model_names = [name for name, info in MODEL_INFO.items() if os.path.exists(info['graphFile'])]
+    if not model_names:
+        raise Exception('No models found')
+
+    # XLA flags are read once by the first session, so they are set for all models at once
+    if any(session_config.load_tuned(name).get('xla') for name in model_names):
+        session_config.enable_cpu_jit()
+
+    # TF thread pools are shared by all sessions of the process and sized by the first one,
+    # so threads tuned for the default model are used for all of them
+    tuned = session_config.load_tuned(model_names[0])
+    threads = {name: tuned.get(name, 0) for name in ('intra_threads', 'inter_threads')}
+    print(f'Session threads of {model_names[0]} are used for all models: {threads}')
+
+    _Handler.models = {name: BatchingModel(name, args.max_batch, args.max_wait / 1000.0, threads) for name in model_names}
+    _Handler.default_model = model_names[0]
+
+    server = http.server.ThreadingHTTPServer((args.host, args.port), _Handler)
+    print(f'Serving on http://{args.host}:{args.port}/classify (models: {", ".join(model_names)})')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,85 @@
+import json
+import os
+import tensorflow as tf
+from tensorflow.core.protobuf import rewriter_config_pb2
+
+# This module is also used by ../classify-tf1 which runs on Python 2, keep it compatible
+
+# Session options chosen by autotune.py per model, used by default
+TUNED_FILE = 'session_config.json'
+
+_TOGGLES = {
+    'on': rewriter_config_pb2.RewriterConfig.ON,
+    'off': rewriter_config_pb2.RewriterConfig.OFF,
+    'aggressive': rewriter_config_pb2.RewriterConfig.AGGRESSIVE,
+}
+
+
+def parse_grappler(value):
+    """
+    Parses Grappler options like "constant_folding=off,remapping=on" into a dict.
+    `meta_optimizer=off` disables Grappler at all.
+    """
+    options = {}
+    for item in (value or '').split(','):
+        if item:
+            name, _, toggle = item.partition('=')
+            options[name.strip()] = toggle.strip().lower()
+    return options
+
+
+def make_config(intra_threads=0, inter_threads=0, xla=False, grappler=None):
+    """
+    Session config with given CPU threads, global XLA JIT and Grappler optimizers, 0 threads mean TF default.
+    """
+    config = tf.compat.v1.ConfigProto()
+    config.gpu_options.allow_growth = True
+    config.intra_op_parallelism_threads = intra_threads
+    config.inter_op_parallelism_threads = inter_threads
+    if xla:
+        # CPU graphs are compiled only with TF_XLA_FLAGS=--tf_xla_cpu_global_jit, see enable_cpu_jit()
+        config.graph_options.optimizer_options.global_jit_level = tf.compat.v1.OptimizerOptions.ON_1
+
+    rewrite = config.graph_options.rewrite_options
+    for name, toggle in (grappler or {}).items():
+        if name == 'meta_optimizer':
+            rewrite.disable_meta_optimizer = toggle == 'off'
+            continue
+        if not hasattr(rewrite, name) or toggle not in _TOGGLES:
+            raise Exception('Unsupported Grappler option {}={}'.format(name, toggle))
+        setattr(rewrite, name, _TOGGLES[toggle])
+    return config
+
+
+def enable_cpu_jit():
+    """
+    Lets global XLA JIT compile graphs on CPU, it has effect only when called before TF initializes XLA,
+    and only for sessions which enable XLA in their config.
+    """
+    flags = os.environ.get('TF_XLA_FLAGS', '')
+    if '--tf_xla_cpu_global_jit' not in flags:
+        os.environ['TF_XLA_FLAGS'] = (flags + ' --tf_xla_cpu_global_jit').strip()
+
+
+def load_tuned(model_name):
+    """
+    Returns session options saved by autotune.py for the model as kwargs of make_config(), or an empty dict.
+    """
+    if not os.path.exists(TUNED_FILE):
+        return {}
+    with open(TUNED_FILE) as f:
+        tuned = json.load(f).get(model_name)
+    if not tuned:
+        return {}
+    return {name: tuned[name] for name in ('intra_threads', 'inter_threads', 'xla', 'grappler')}
+
+
+def save_tuned(model_name, options):
+    tuned = {}
+    if os.path.exists(TUNED_FILE):
+        with open(TUNED_FILE) as f:
+            tuned = json.load(f)
+    tuned[model_name] = options
+    with open(TUNED_FILE, 'w') as f:
+        json.dump(tuned, f, indent=2)
+    print('Session config for {} saved to {}'.format(model_name, TUNED_FILE))
@@ -0,0 +1,148 @@
+import json
+import multiprocessing
+import os
+import time
+
+# This module is also used by ../classify-tf1 which runs on Python 2, keep it compatible
+
+# Worker process setup, see _init_process
+_classify_chunk = None
+
+
+def _cpu_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(multiprocessing.cpu_count()))
+
+
+def _init_process(init_worker, classify_chunk, counter, num_workers):
+    global _classify_chunk
+    _classify_chunk = classify_chunk
+
+    with counter.get_lock():
+        worker_index = counter.value
+        counter.value += 1
+
+    # Each worker gets its own share of cores, its session threads are limited to them
+    cores = _cpu_cores()
+    share = max(1, len(cores) // num_workers)
+    worker_cores = cores[worker_index * share:(worker_index + 1) * share] or cores
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, worker_cores)
+    print('Worker {}: pid {}, cores {}'.format(worker_index, os.getpid(), worker_cores))
+    init_worker(len(worker_cores), 1)
+
+
+def _run_chunk(file_names):
+    return _classify_chunk(file_names)
+
+
+def _csv_value(value):
+    value = str(value)
+    if any(c in value for c in ',"\n'):
+        value = '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def _format(record, csv, result_count):
+    """
+    Record is {file, labels: [(label, score)]} or {file, error}.
+    """
+    if not csv:
+        return json.dumps(record) + '\n'
+    values = [record['file'], record.get('error', '')]
+    labels = record.get('labels', [])
+    for i in range(result_count):
+        values += labels[i] if i < len(labels) else ['', '']
+    return ','.join(_csv_value(v) for v in values) + '\n'
+
+
+def _csv_header(result_count):
+    columns = ['file', 'error']
+    for i in range(result_count):
+        columns += ['label_{}'.format(i + 1), 'score_{}'.format(i + 1)]
+    return ','.join(columns) + '\n'
+
+
+class ShardedClassifier(object):
+    """
+    Classifies a list of files in several worker processes.
+
+    Files are split into chunks of consecutive files which are given to free workers,
+    results are written in the order of files as JSON lines, or CSV for `.csv` output.
+    After each written chunk, the number of done chunks and the output size are saved
+    to `<output>.ckpt`, with `resume` the output is truncated to the saved size
+    and done chunks are skipped.
+
+    `init_worker(intra_threads, inter_threads)` and `classify_chunk(file_names) -> records`
+    are called in worker processes, they must be module level functions.
+    """
+    def __init__(self, init_worker, classify_chunk, num_workers, chunk_size, result_count):
+        self.init_worker = init_worker
+        self.classify_chunk = classify_chunk
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self.result_count = result_count
+
+    def _load_checkpoint(self, checkpoint_file, file_count):
+        if not os.path.exists(checkpoint_file):
+            return 0, 0
+        with open(checkpoint_file) as f:
+            checkpoint = json.load(f)
+        if checkpoint['files'] != file_count or checkpoint['chunk_size'] != self.chunk_size:
+            raise Exception('Checkpoint {} is for another file list or chunk size'.format(checkpoint_file))
+        return checkpoint['chunks'], checkpoint['offset']
+
+    def _save_checkpoint(self, checkpoint_file, file_count, chunks, offset):
+        tmp_file = checkpoint_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'files': file_count, 'chunk_size': self.chunk_size, 'chunks': chunks, 'offset': offset}, f)
+        os.rename(tmp_file, checkpoint_file)
+
+    def run(self, file_names, output, resume):
+        csv = output.lower().endswith('.csv')
+        checkpoint_file = output + '.ckpt'
+        chunks = [file_names[i:i+self.chunk_size] for i in range(0, len(file_names), self.chunk_size)]
+
+        done_chunks, offset = 0, 0
+        if resume and os.path.exists(output):
+            done_chunks, offset = self._load_checkpoint(checkpoint_file, len(file_names))
+            print('Resume from chunk {} of {}'.format(done_chunks, len(chunks)))
+
+        # Spawned workers don't inherit anything the parent may have initialized, e.g. TF runtime
+        ctx = multiprocessing.get_context('spawn') if hasattr(multiprocessing, 'get_context') else multiprocessing
+        counter = ctx.Value('i', 0)
+        pool = ctx.Pool(self.num_workers, _init_process, (self.init_worker, self.classify_chunk, counter, self.num_workers))
+
+        count = 0
+        errors = 0
+        start_time = time.time()
+        out = open(output, 'r+b' if offset else 'wb')
+        try:
+            # Results of a partially written chunk are dropped, the chunk is done again
+            out.seek(offset)
+            out.truncate()
+            if csv and not offset:
+                out.write(_csv_header(self.result_count).encode('utf-8'))
+
+            # imap gives results in the order of chunks, those done by faster workers wait in the pool
+            for i, records in enumerate(pool.imap(_run_chunk, chunks[done_chunks:]), done_chunks):
+                for record in records:
+                    out.write(_format(record, csv, self.result_count).encode('utf-8'))
+                    errors += 'error' in record
+                count += len(records)
+                out.flush()
+                os.fsync(out.fileno())
+                self._save_checkpoint(checkpoint_file, len(file_names), i + 1, out.tell())
+
+                elapsed = time.time() - start_time
+                print('Chunk {}/{}: {} images, {:.1f} images/s'.format(i + 1, len(chunks), count, count / elapsed))
+            pool.close()
+        finally:
+            out.close()
+            pool.terminate()
+            pool.join()
+
+        elapsed = time.time() - start_time
+        print('Classified {} images ({} errors) in {:.1f} s, {:.1f} images/s'.format(
+            count, errors, elapsed, count / elapsed if elapsed else 0.0))
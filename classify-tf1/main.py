@@ -1,9 +1,16 @@
 import argparse
 import os
+import sys
 import time
 import numpy as np
 import tensorflow as tf
 
+# The cache, sharding and session config are shared with the TF2 example
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'classify-tf'))
+import session_config
+from input_cache import InputCache
+from sharding import ShardedClassifier
+
 MODEL_INFO = {
     'mobilenet_v1': {
         'imgSize': 160,
@@ -34,17 +41,57 @@ OUTPUT_LAYER = MODEL_INFO[MODEL_NAME]['outputLayer']
 
 RESULT_COUNT = 5
 
+# Changes when _preprocess does, so cached images of the old preprocessing aren't used
+CACHE_VARIANT = 'tf-resize-float32-v1'
+
 # https://www.tensorflow.org/api_docs/python/tf/image/resize
-def _load_image(file_name):
+def _preprocess(file_name):
     read_file = tf.io.read_file(file_name)
     decode_img = tf.io.decode_jpeg(read_file, channels=3)
     cast_float = tf.cast(decode_img, tf.float32)
-    expand_dims = tf.expand_dims(cast_float, 0)
-    resize = tf.image.resize(expand_dims, [IMG_SIZE, IMG_SIZE])
+    resize = tf.image.resize(cast_float, [IMG_SIZE, IMG_SIZE])
     subt_mean = tf.subtract(resize, [IMG_MEAN])
     normalize = tf.divide(subt_mean, [255.0])
-    sess = tf.compat.v1.Session()
-    return sess.run(normalize)
+    return normalize
+
+
+# https://www.tensorflow.org/guide/data_performance
+def _load_images(file_names, prefetch, config=None):
+    """
+    Yields preprocessed images of shape [1, IMG_SIZE, IMG_SIZE, 3] in the order of file names.
+
+    Preprocessing ops are created once in their own graph and session, files are decoded
+    in parallel and up to `prefetch` images are decoded ahead while the caller is busy with previous ones.
+    The session `config` should be the one of classification, the first session of the process sizes TF thread pools.
+    """
+    if not file_names:
+        return
+    graph = tf.Graph()
+    with graph.as_default():
+        dataset = tf.data.Dataset.from_tensor_slices(file_names)
+        dataset = dataset.map(_preprocess, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        dataset = dataset.batch(1)
+        dataset = dataset.prefetch(prefetch)
+        next_image = tf.compat.v1.data.make_one_shot_iterator(dataset).get_next()
+
+    with tf.compat.v1.Session(graph=graph, config=config) as sess:
+        while True:
+            try:
+                yield sess.run(next_image)
+            except tf.errors.OutOfRangeError:
+                return
+
+
+def _load_cached_images(file_names, cache, prefetch, config=None):
+    """
+    Yields memory-mapped images from the cache, only missing ones are decoded and added to it.
+    """
+    cached = [cache.lookup(fn) for fn in file_names]
+    missing = _load_images([fn for fn, img in zip(file_names, cached) if img is None], prefetch, config)
+    for fn, img in zip(file_names, cached):
+        if img is None:
+            img = cache.put(fn, next(missing))
+        yield img
 
 
 def _load_labels():
@@ -64,26 +111,113 @@ def _load_graph():
     return graph
 
 
+# Sessions of a sharded worker process, see ../classify-tf/sharding.py
+_worker = {}
+
+
+def _init_worker(intra_threads, inter_threads):
+    config = tf.compat.v1.ConfigProto()
+    config.intra_op_parallelism_threads = intra_threads
+    config.inter_op_parallelism_threads = inter_threads
+
+    # Preprocessing graph fed by file names, built once per worker
+    graph = tf.Graph()
+    with graph.as_default():
+        _worker['file_name'] = tf.compat.v1.placeholder(tf.string, [])
+        _worker['image'] = tf.expand_dims(_preprocess(_worker['file_name']), 0)
+    _worker['preprocess_sess'] = tf.compat.v1.Session(graph=graph, config=config)
+
+    graph = _load_graph()
+    _worker['input'] = graph.get_operation_by_name('import/' + INPUT_LAYER).outputs[0]
+    _worker['output'] = graph.get_operation_by_name('import/' + OUTPUT_LAYER).outputs[0]
+    _worker['sess'] = tf.compat.v1.Session(graph=graph, config=config)
+    _worker['labels'] = _load_labels()
+
+
+def _classify_chunk(file_names):
+    """
+    Classifies files as one batch, returns a record per file, images failed to decode get an error.
+    """
+    records = []
+    imgs = []
+    for fn in file_names:
+        try:
+            imgs.append(_worker['preprocess_sess'].run(_worker['image'], {_worker['file_name']: fn}))
+            records.append({'file': fn})
+        except tf.errors.OpError as e:
+            records.append({'file': fn, 'error': e.message})
+    if not imgs:
+        return records
+
+    results = _worker['sess'].run(_worker['output'], {_worker['input']: np.concatenate(imgs)})
+    labels = _worker['labels']
+    ok_records = [r for r in records if 'error' not in r]
+    for record, scores in zip(ok_records, results):
+        record['labels'] = [(labels[i], float(scores[i])) for i in scores.argsort()[-RESULT_COUNT:][::-1]]
+    return records
+
+
 def _main():
     print('Sample image classification')
 
     parser = argparse.ArgumentParser()
     parser.add_argument('input', help='input image')
     parser.add_argument('-l', '--loops', help='', type=int, default=1)
+    parser.add_argument('--cache', help='directory to cache preprocessed images in')
+    parser.add_argument('--cache-size', help='max size of the cache, MB', type=int, default=1024)
+    parser.add_argument('--intra-threads', help='threads to run an op, 0 means TF default', type=int, default=0)
+    parser.add_argument('--inter-threads', help='threads to run independent ops, 0 means TF default', type=int, default=0)
+    parser.add_argument('--xla', help='enable global XLA JIT compilation', action='store_true')
+    parser.add_argument('--grappler', help='Grappler optimizer options, e.g. "constant_folding=off,remapping=on", "meta_optimizer=off" disables it')
+    parser.add_argument('--prefetch', help='max number of images decoded ahead of classification', type=int, default=16)
+    parser.add_argument('-w', '--workers', help='classify a directory in this many processes, sharing CPU cores between them', type=int, default=0)
+    parser.add_argument('-o', '--output', help='JSONL or CSV file for results of sharded classification')
+    parser.add_argument('--chunk-size', help='number of images given to a worker at once', type=int, default=64)
+    parser.add_argument('--resume', help='continue sharded classification from its checkpoint', action='store_true')
     args = parser.parse_args()
 
+    # Before the first session, including the one of tf.data, XLA flags are read then
+    if args.xla:
+        session_config.enable_cpu_jit()
+
     if not args.input:
         raise Exception('Input source is not specified')
 
+    if args.workers:
+        if not args.output:
+            raise Exception('Output file is required for sharded classification')
+        # Sorted, so the order is the same when resuming
+        file_names = [os.path.join(args.input, fn) for fn in sorted(os.listdir(args.input))]
+        classifier = ShardedClassifier(_init_worker, _classify_chunk, args.workers, args.chunk_size, RESULT_COUNT)
+        classifier.run(file_names, args.output, args.resume)
+        return
+
+    # Preprocessing with --loops runs before classification, its session must have the same config
+    config = session_config.make_config(args.intra_threads, args.inter_threads, args.xla, session_config.parse_grappler(args.grappler))
+    config.gpu_options.per_process_gpu_memory_fraction = 0.33
+    #config.log_device_placement = True
+
     # Load images
-    imgs = [] # {name, data}[]
     if os.path.isdir(args.input):
-        for fn in os.listdir(args.input):
-            img = _load_image(os.path.join(args.input, fn))
-            imgs.append({'name': fn, 'data': img})
+        names = os.listdir(args.input)
+        file_names = [os.path.join(args.input, fn) for fn in names]
     else:
-        img = _load_image(args.input)
-        imgs.append({'name': args.input, 'data': img})
+        names = [args.input]
+        file_names = [args.input]
+    cache = None
+    if args.cache:
+        cache = InputCache(args.cache, IMG_SIZE, CACHE_VARIANT, args.cache_size * 1024 * 1024)
+        loaded = _load_cached_images(file_names, cache, args.prefetch, config)
+    else:
+        loaded = _load_images(file_names, args.prefetch, config)
+    # Not zip(), it's not lazy in Python 2
+    imgs = ({'name': names[i], 'data': img} for i, img in enumerate(loaded)) # {name, data}[]
+    # Images are needed for each loop in benchmark mode, otherwise classify them as they are decoded,
+    # so memory depends only on the prefetch depth
+    if args.loops != 1:
+        imgs = list(imgs)
+        if cache:
+            cache.print_stats()
 
     labels = _load_labels()
 
@@ -93,11 +227,6 @@ def _main():
     input = graph.get_operation_by_name('import/' + INPUT_LAYER).outputs[0]
     output = graph.get_operation_by_name('import/' + OUTPUT_LAYER).outputs[0]
 
-    config = tf.compat.v1.ConfigProto()
-    config.gpu_options.allow_growth = True
-    config.gpu_options.per_process_gpu_memory_fraction = 0.33
-    #config.log_device_placement = True
-
     loops = 0
     total_images = 0
     total_elapsed = 0.0
@@ -130,6 +259,9 @@ def _main():
             if loops == args.loops:
                 break
 
+    if cache and args.loops == 1:
+        cache.print_stats()
+
 
 if __name__ == '__main__':
     _main()
@@ -0,0 +1,22 @@
+#!/bin/bash
+
+# Downloads additional SSD models of the catalogue in box-detect-tflite/models.py
+
+SCRIPT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
+
+for MODEL_DIR in ssd_mobilenet_v3_small_coco_2020_01_14 ssd_mobilenet_v3_large_coco_2020_01_14; do
+    if [ ! -f "$SCRIPT_DIR/$MODEL_DIR/model.tflite" ]; then
+        curl -L "http://download.tensorflow.org/models/object_detection/$MODEL_DIR.tar.gz" | tar -C $SCRIPT_DIR -xz
+    else
+        echo "Model already there: $MODEL_DIR"
+    fi
+done
+
+MODEL_DIR=ssd_mobiledet_cpu_coco
+if [ ! -f "$SCRIPT_DIR/$MODEL_DIR/model.tflite" ]; then
+    mkdir -p "$SCRIPT_DIR/$MODEL_DIR"
+    curl -L "http://download.tensorflow.org/models/object_detection/ssdlite_mobiledet_cpu_320x320_coco_2020_05_19.tar.gz" \
+        | tar -C "$SCRIPT_DIR/$MODEL_DIR" -xz --strip-components=1
+else
+    echo "Model already there: $MODEL_DIR"
+fi